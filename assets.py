@@ -0,0 +1,143 @@
+import base64
+import io
+import os
+import threading
+from types import MappingProxyType
+
+import metrics
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+# Streamlit serves ./static at this path when server.enableStaticServing is on
+STATIC_URL = "app/static"
+
+PET_IMAGES = ['PolarBear.gif', 'Koala.gif', 'Whale.gif']
+
+ASSET_WIDTH = int(os.environ.get("ECOBUDDIES_ASSET_WIDTH", 200))
+ASSET_FRAME_STEP = int(os.environ.get("ECOBUDDIES_ASSET_FRAME_STEP", 1))
+ASSET_FORMAT = os.environ.get("ECOBUDDIES_ASSET_FORMAT", "gif")  # gif or webp
+INLINE_ASSETS = os.environ.get("ECOBUDDIES_INLINE_ASSETS", "0") == "1"
+
+_assets = None
+_build_lock = threading.Lock()
+
+_page_bytes = {}
+_page_bytes_lock = threading.Lock()
+
+
+def rendition_name(image, width=ASSET_WIDTH, frame_step=ASSET_FRAME_STEP, fmt=ASSET_FORMAT):
+    stem = os.path.splitext(image)[0]
+    step = f"-every{frame_step}" if frame_step > 1 else ""
+    return f"{stem}-{width}w{step}.{fmt}"
+
+
+def render_rendition(src_path, width, frame_step=1, fmt="gif"):
+    # Imported here: renditions from a previous start or the build step never need PIL
+    from PIL import Image, ImageSequence
+
+    src = Image.open(src_path)
+    frames = []
+    durations = []
+    for i, frame in enumerate(ImageSequence.Iterator(src)):
+        duration = frame.info.get('duration', 100)
+        if i % frame_step:
+            # Fold dropped frames into the previous one so the loop keeps its speed
+            durations[-1] += duration
+            continue
+        rgba = frame.convert("RGBA")
+        height = round(rgba.height * width / rgba.width)
+        frames.append(rgba.resize((width, height), Image.LANCZOS))
+        durations.append(duration)
+
+    buf = io.BytesIO()
+    if fmt == "webp":
+        frames[0].save(buf, format="WEBP", save_all=True, append_images=frames[1:],
+                       duration=durations, loop=0, quality=80, method=6)
+    else:
+        frames[0].save(buf, format="GIF", save_all=True, append_images=frames[1:],
+                       duration=durations, loop=0, disposal=2, optimize=True)
+    return buf.getvalue()
+
+
+def build_rendition(image):
+    src_path = os.path.join(APP_DIR, image)
+    name = rendition_name(image)
+    out_path = os.path.join(STATIC_DIR, name)
+    # Reuse renditions from a previous start (or a build step) unless the source changed
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(src_path):
+        with open(out_path, "rb") as f:
+            data = f.read()
+    else:
+        data = render_rendition(src_path, ASSET_WIDTH, ASSET_FRAME_STEP, ASSET_FORMAT)
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
+
+    asset = {
+        'url': f"{STATIC_URL}/{name}",
+        'bytes': len(data),
+        'source_bytes': os.path.getsize(src_path),
+    }
+    if INLINE_ASSETS:
+        asset['url'] = f"data:image/{ASSET_FORMAT};base64,{base64.b64encode(data).decode()}"
+    return MappingProxyType(asset)
+
+
+def build_assets():
+    global _assets
+    if _assets is None:
+        with _build_lock:
+            if _assets is None:
+                with metrics.span("asset_build"):
+                    _assets = MappingProxyType({image: build_rendition(image) for image in PET_IMAGES})
+    return _assets
+
+
+def warm_assets():
+    # Builds the renditions off the script thread, so no render waits on Pillow
+    if _assets is None:
+        threading.Thread(target=build_assets, name="asset-build", daemon=True).start()
+
+
+def asset_url(image):
+    return build_assets()[image]['url']
+
+
+def asset_bytes(image):
+    return build_assets()[image]['bytes']
+
+
+def record_page_bytes(page, html_bytes, image_bytes=0):
+    with _page_bytes_lock:
+        stats = _page_bytes.setdefault(page, {'renders': 0, 'html_bytes': 0, 'asset_bytes': 0})
+        stats['renders'] += 1
+        stats['html_bytes'] += html_bytes
+        stats['asset_bytes'] += image_bytes
+
+
+def page_bytes_report():
+    with _page_bytes_lock:
+        return {
+            page: dict(stats, bytes_per_render=(stats['html_bytes'] + stats['asset_bytes']) / stats['renders'])
+            for page, stats in _page_bytes.items()
+        }
+
+
+def collect_page_bytes():
+    samples = []
+    for page, stats in page_bytes_report().items():
+        samples.append(("ecobuddies_page_renders_total", "counter", {'page': page}, stats['renders']))
+        samples.append(("ecobuddies_page_bytes_total", "counter", {'page': page, 'kind': 'html'}, stats['html_bytes']))
+        samples.append(("ecobuddies_page_bytes_total", "counter", {'page': page, 'kind': 'asset'}, stats['asset_bytes']))
+    return samples
+
+
+metrics.register_collector('page_bytes', collect_page_bytes)
+
+
+if __name__ == '__main__':
+    # Build step: python assets.py
+    for image, asset in build_assets().items():
+        print(f"{image}: {asset['source_bytes']} -> {asset['bytes']} bytes ({asset['url']})")
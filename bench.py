@@ -0,0 +1,232 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+# The benchmark always runs against the offline backend; set before the app modules load
+os.environ["ECOBUDDIES_BACKEND"] = "fake"
+os.environ.setdefault("ECOBUDDIES_FAKE_LATENCY", "0.05")
+os.environ.setdefault("ECOBUDDIES_FAKE_JITTER", "0.02")
+# Simulated users never touch the app's saved progress (or the community totals built from it)
+os.environ["ECOBUDDIES_PROGRESS_STORE"] = "memory"
+
+from streamlit.testing.v1 import AppTest
+
+import metrics
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "streamlit_app.py")
+PETS = ['Polar Bear', 'Koala', 'Whale']
+RESULTS_VERSION = 2
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS, but still comparable between runs
+        scale = 1 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def click(at, label):
+    button = next(b for b in at.button if b.label.startswith(label))
+    return button.click()
+
+
+def journey(session_index):
+    # One user walking every screen: (label, action, fragment) triples, each action followed by a
+    # rerun. fragment names the st.fragment that owns the widget, for interactions that only
+    # rerun that fragment in the real app.
+    pet = PETS[session_index % len(PETS)]
+    return [
+        ('gif', lambda at: at, None),
+        ('quiz', lambda at: click(at, 'EcoBuddies Quiz'), None),
+        ('welcome', lambda at: click(at, 'Continue to EcoBuddies'), None),
+        ('pet/0', lambda at: click(at, f'Choose {pet}'), None),
+        ('pet/1', lambda at: click(at, 'Next'), None),
+        ('pet/4', lambda at: click(at, next(b.label for b in at.button if b.label.endswith('pts)'))), None),
+        ('pet/4:how', lambda at: click(at, '🔎 How?'), 'followup'),
+        ('pet/4:complete', lambda at: click(at, '✅ Complete Task'), None),
+        ('pet/3', lambda at: click(at, '🗝 Interactive Adventure!'), None),
+        ('pet/3:chat', lambda at: at.text_input(key='chat_input').input(f'I pick option {session_index % 3 + 1}'), 'chat'),
+        ('pet/1:home', lambda at: click(at, '🏠 Go Home'), None),
+        ('pet/2', lambda at: click(at, '➡️ Identify trash'), None),
+    ]
+
+
+def fragment_seconds(fragment):
+    # Total time spent so far inside the given fragment's body, from the span histogram sums
+    _, _, histograms = metrics.snapshot()
+    return sum(
+        buckets[-1] for (name, labels), buckets in histograms.items()
+        if name == "ecobuddies_span_seconds" and ('span', 'fragment') in labels and ('fragment', fragment) in labels
+    )
+
+
+def run_worker(session_indices, timeout, cold=False):
+    # AppTest swaps a process-global runtime in and out around every run, so reruns within
+    # one process are serialized. Sessions are interleaved step by step so they all stay
+    # live together and share the process-wide caches; --workers adds real parallelism.
+    from cache import response_cache
+    from llm import backend
+
+    if cold:
+        response_cache.clear()
+    calls_before = backend.calls
+    cpu_before = time.process_time()
+    rss_before = rss_bytes()
+
+    apps = {i: AppTest.from_file(APP_PATH, default_timeout=timeout) for i in session_indices}
+    journeys = {i: journey(i) for i in session_indices}
+    screens = {}
+    fragments = {}
+    errors = []
+    for step in range(len(journey(0))):
+        for i, at in list(apps.items()):
+            label, action, fragment = journeys[i][step]
+            try:
+                target = action(at)
+                fragment_before = fragment_seconds(fragment) if fragment else 0
+                start = time.perf_counter()
+                target.run()
+                elapsed = time.perf_counter() - start
+                if at.exception:
+                    raise RuntimeError(at.exception[0].value)
+            except Exception as e:
+                errors.append(f"session {i} {label}: {e}")
+                del apps[i]
+                continue
+            screens.setdefault(label, []).append(elapsed)
+            # AppTest always reruns the whole script; the fragment's own time is what the
+            # server does for this interaction when only the fragment reruns
+            if fragment:
+                fragments.setdefault(label, []).append(fragment_seconds(fragment) - fragment_before)
+
+    return {
+        'screens': screens,
+        'fragments': fragments,
+        'errors': errors,
+        'completed': len(apps),
+        'llm_calls': backend.calls - calls_before,
+        'cpu_seconds': time.process_time() - cpu_before,
+        'rss_bytes': rss_bytes() - rss_before,
+    }
+
+
+def run_benchmark(sessions, workers, timeout, cold=False):
+    started = time.perf_counter()
+    chunks = [list(range(sessions))[w::workers] for w in range(workers)]
+    if workers == 1:
+        partials = [run_worker(chunks[0], timeout, cold)]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            partials = pool.starmap(run_worker, [(chunk, timeout, cold) for chunk in chunks])
+    wall = time.perf_counter() - started
+
+    screens = {}
+    fragments = {}
+    for partial in partials:
+        for label, values in partial['screens'].items():
+            screens.setdefault(label, []).extend(values)
+        for label, values in partial['fragments'].items():
+            fragments.setdefault(label, []).extend(values)
+    completed = sum(partial['completed'] for partial in partials)
+    per_session = max(1, completed)
+    return {
+        'version': RESULTS_VERSION,
+        'config': {
+            'sessions': sessions,
+            'workers': workers,
+            'cold_cache': cold,
+            'fake_latency': float(os.environ["ECOBUDDIES_FAKE_LATENCY"]),
+            'fake_jitter': float(os.environ["ECOBUDDIES_FAKE_JITTER"]),
+            'python': platform.python_version(),
+        },
+        'wall_seconds': wall,
+        'journeys_per_second': completed / wall if wall else None,
+        'errors': [error for partial in partials for error in partial['errors']],
+        'llm_calls_per_journey': sum(partial['llm_calls'] for partial in partials) / per_session,
+        'cpu_seconds_per_session': sum(partial['cpu_seconds'] for partial in partials) / per_session,
+        'rss_bytes_per_session': sum(partial['rss_bytes'] for partial in partials) / per_session,
+        'screens': {label: summarize(values) for label, values in screens.items()},
+        # Per-interaction server work for clicks handled by a fragment rerun
+        'fragments': {label: summarize(values) for label, values in fragments.items()},
+    }
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def compare(results, baseline, threshold):
+    # Returns the screens whose p95 got slower than the baseline by more than threshold
+    regressions = []
+    for label, stats in results['screens'].items():
+        before = baseline.get('screens', {}).get(label)
+        if before and before['p95'] and stats['p95'] > before['p95'] * (1 + threshold):
+            regressions.append((label, before['p95'], stats['p95']))
+    return regressions
+
+
+def print_report(results):
+    print(f"{'screen':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'fragment p95':>14}")
+    for label, stats in results['screens'].items():
+        fragment = results['fragments'].get(label)
+        fragment_p95 = f"{fragment['p95'] * 1000:.1f}" if fragment else "-"
+        print(f"{label:<16}{stats['count']:>7}{stats['p50'] * 1000:>10.1f}"
+              f"{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}{fragment_p95:>14}")
+    print(f"LLM calls/journey: {results['llm_calls_per_journey']:.1f}  "
+          f"CPU s/session: {results['cpu_seconds_per_session']:.3f}  "
+          f"RSS KiB/session: {results['rss_bytes_per_session'] / 1024:.0f}  "
+          f"errors: {len(results['errors'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted EcoBuddies journeys against the fake backend.")
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=1, help="processes to spread the sessions over")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds allowed per rerun")
+    parser.add_argument('--cold', action='store_true', help="clear the response cache before the run")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare p95s against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed p95 slowdown vs the baseline")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sessions, args.workers, args.timeout, cold=args.cold)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for label, before, after in regressions:
+            print(f"REGRESSION {label}: p95 {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
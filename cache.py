@@ -0,0 +1,159 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def normalize_prompt(prompt):
+    # Collapse whitespace so indentation changes in the f-strings don't miss the cache
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def cache_key(prompt, model_name):
+    return hashlib.sha256(f"{model_name}\n{normalize_prompt(prompt)}".encode()).hexdigest()
+
+
+# Disk hit times are written once this many are pending or this many seconds have passed
+USED_FLUSH_SIZE = 64
+USED_FLUSH_INTERVAL = 60.0
+
+
+class ResponseCache:
+    def __init__(self, max_entries=512, ttl=None, db_path=None, disk_max_entries=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries or max_entries * 10
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (stored_at, text), oldest first
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._used = {}  # key -> last hit time not yet written to disk
+        self._used_flushed = time.monotonic()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, stored_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._purge_disk()
+
+    @classmethod
+    def from_env(cls):
+        ttl = os.environ.get("ECOBUDDIES_CACHE_TTL")
+        return cls(
+            max_entries=int(os.environ.get("ECOBUDDIES_CACHE_SIZE", 512)),
+            ttl=float(ttl) if ttl else None,
+            db_path=os.environ.get("ECOBUDDIES_CACHE_DB"),
+        )
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, prompt, model_name):
+        key = cache_key(prompt, model_name)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0], now):
+                # Left for the LRU to evict, so get_stale can still serve it during an outage
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT stored_at, text FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[0], now):
+                    entry = row
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self._db is not None:
+                self._touch(key, now)
+            return entry[1]
+
+    def _touch(self, key, now):
+        # Hit times only order the disk purge, so they're written in batches rather than
+        # committing on every hit
+        self._used[key] = now
+        if len(self._used) >= USED_FLUSH_SIZE or time.monotonic() - self._used_flushed > USED_FLUSH_INTERVAL:
+            self._flush_used()
+            self._db.commit()
+
+    def _flush_used(self):
+        if self._used:
+            self._db.executemany("UPDATE responses SET used_at = ? WHERE key = ?", [(t, k) for k, t in self._used.items()])
+            self._used.clear()
+        self._used_flushed = time.monotonic()
+
+    def get_stale(self, prompt, model_name):
+        # Ignores the TTL and the hit counters; for serving something when the model is down
+        key = cache_key(prompt, model_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db.execute("SELECT stored_at, text FROM responses WHERE key = ?", (key,)).fetchone()
+        return entry[1] if entry is not None else None
+
+    def set(self, prompt, model_name, text):
+        key = cache_key(prompt, model_name)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (now, text))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, text, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                    (key, text, now, now),
+                )
+                self._flush_used()
+                self._db.commit()
+                self._writes += 1
+                if self._writes % 64 == 0:
+                    self._purge_disk()
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _purge_disk(self):
+        self._flush_used()
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY used_at DESC LIMIT ?)",
+            (self.disk_max_entries,),
+        )
+        self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._used.clear()
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+
+# Imported modules survive reruns, so this one instance is shared by every session in the process
+response_cache = ResponseCache.from_env()
+metrics.register_collector('response_cache', metrics.cache_collector('response', response_cache))
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+
+import metrics
+
+# Bump when the file layout changes; a file in another format is refused
+CATALOG_FORMAT = 1
+DEFAULT_LOCALE = os.environ.get("ECOBUDDIES_LOCALE", "en")
+
+
+class ActionCatalog:
+    # Eco actions loaded from a data file once per process, with the lookups the pages need
+    # precomputed, so rendering a page of actions costs the same for ten actions or ten thousand.
+    # An action's English name is its task name: completion, caches and packs are keyed by it.
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.locales = []
+        self.categories = {}  # category id -> {'topics', 'names'}
+        self._by_name = None
+        self._by_pet = {}  # pet tag -> actions in file order
+        self._by_category = {}  # (pet tag, category id) -> actions in file order
+        self._by_points = {}  # (pet tag, category id or None) -> actions, most points first
+        self._by_topic = {}  # (pet tag, topic) -> actions in the topic's categories first, then the rest
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._by_name is not None:
+                return
+            with metrics.span("catalog_load") as attrs, open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+                if data.get('format') != CATALOG_FORMAT:
+                    raise ValueError(f"{self.path} is in catalog format {data.get('format')!r}, expected {CATALOG_FORMAT}")
+                self._index(data)
+                attrs['actions'] = len(self._by_name)
+
+    def _index(self, data):
+        self.version = data['version']
+        self.locales = data['locales']
+        self.categories = data['categories']
+        by_name = {}
+        for action in data['actions']:
+            if action['category'] not in self.categories:
+                raise ValueError(f"Action {action['id']!r} has unknown category {action['category']!r}")
+            action = dict(action, name=action['names']['en'])
+            by_name[action['name']] = action
+            for pet_tag in action['pets']:
+                self._by_pet.setdefault(pet_tag, []).append(action)
+                self._by_category.setdefault((pet_tag, action['category']), []).append(action)
+
+        topics = {topic for category in self.categories.values() for topic in category['topics']}
+        for key, actions in [((pet_tag, None), actions) for pet_tag, actions in self._by_pet.items()] + list(self._by_category.items()):
+            self._by_points[key] = sorted(actions, key=lambda action: -action['points'])
+        for pet_tag, actions in self._by_pet.items():
+            for topic in topics:
+                first = [action for action in actions if topic in self.categories[action['category']]['topics']]
+                rest = [action for action in actions if topic not in self.categories[action['category']]['topics']]
+                self._by_topic[(pet_tag, topic)] = first + rest
+        self._by_name = by_name
+
+    def get(self, name):
+        if self._by_name is None:
+            self._load()
+        return self._by_name.get(name)
+
+    def for_pet(self, pet_tag, category=None, topic=None, by_points=False):
+        # Shared, precomputed lists; callers must not modify them
+        if self._by_name is None:
+            self._load()
+        if by_points:
+            return self._by_points.get((pet_tag, category), [])
+        if category is not None:
+            return self._by_category.get((pet_tag, category), [])
+        if topic is not None:
+            return self._by_topic.get((pet_tag, topic), self._by_pet.get(pet_tag, []))
+        return self._by_pet.get(pet_tag, [])
+
+    def pet_categories(self, pet_tag):
+        if self._by_name is None:
+            self._load()
+        return [category for category in self.categories if (pet_tag, category) in self._by_category]
+
+    def label(self, action, locale=DEFAULT_LOCALE):
+        return action['names'].get(locale, action['name'])
+
+    def category_label(self, category, locale=DEFAULT_LOCALE):
+        names = self.categories[category]['names']
+        return names.get(locale, names['en'])
+
+
+action_catalog = ActionCatalog(os.environ.get("ECOBUDDIES_ACTIONS_FILE", "actions.json"))
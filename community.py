@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+
+import metrics
+from store import progress_store
+
+
+class Community:
+    # Community totals and a top-k leaderboard per pet, updated as each task is completed
+    # rather than recomputed from every user's progress. Pages read a snapshot that is
+    # rebuilt at most every `refresh` seconds, so reading it on every rerun is a dict lookup.
+    # Totals are per process, seeded from the progress store when first read or updated.
+    def __init__(self, top_k=10, refresh=5.0):
+        self.top_k = top_k
+        self.refresh = refresh
+        self.points = 0
+        self.tasks = 0
+        self.actions = 0
+        self._users = set()
+        self._top = {}  # pet tag -> [(points, user_id)], best first, at most top_k long
+        self._snapshot = None
+        self._snapshot_at = 0.0
+        self._seeded = False
+        self._seed_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            top_k=int(os.environ.get("ECOBUDDIES_LEADERBOARD_SIZE", 10)),
+            refresh=float(os.environ.get("ECOBUDDIES_COMMUNITY_REFRESH", 5)),
+        )
+
+    def _seed(self):
+        # One pass over saved progress, before the first read or update; every later change is
+        # incremental. Updates are recorded before they're saved and wait for the seed, so the
+        # seed never sees a change that is also counted as an update.
+        with self._seed_lock:
+            if self._seeded:
+                return
+            with metrics.span("community_seed") as attrs:
+                totals = progress_store.load_field('total_points')
+                completed = progress_store.load_field('completed_tasks')
+                actions = progress_store.load_field('sustainable_actions')
+                pet_points = progress_store.load_field('pet_points')
+                attrs['users'] = len(totals)
+            with self._lock:
+                self.points += sum(totals.values())
+                self.tasks += sum(len(tasks) for tasks in completed.values())
+                self.actions += sum(actions.values())
+                self._users.update(user_id for user_id, points in totals.items() if points)
+                for user_id, by_pet in pet_points.items():
+                    for pet_tag, points in by_pet.items():
+                        self._update_score(pet_tag, user_id, points)
+                self._seeded = True
+
+    def record(self, user_id, pet_tag, points, tasks=0, actions=0, pet_total=None):
+        # pet_total is the user's new points with this pet; scores only grow, which is what
+        # lets the top-k be kept up to date without the full list. Call before saving progress.
+        if not self._seeded:
+            self._seed()
+        with self._lock:
+            self.points += points
+            self.tasks += tasks
+            self.actions += actions
+            self._users.add(user_id)
+            if pet_total is not None:
+                self._update_score(pet_tag, user_id, pet_total)
+
+    def _update_score(self, pet_tag, user_id, points):
+        ranked = [(score, uid) for score, uid in self._top.get(pet_tag, []) if uid != user_id]
+        if len(ranked) < self.top_k or points > ranked[-1][0]:
+            ranked.append((points, user_id))
+            ranked.sort(reverse=True)
+            del ranked[self.top_k:]
+        self._top[pet_tag] = ranked
+
+    def snapshot(self):
+        if not self._seeded:
+            self._seed()
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is None or now - self._snapshot_at > self.refresh:
+            with self._lock:
+                snapshot = self._snapshot = {
+                    'points': self.points,
+                    'tasks': self.tasks,
+                    'actions': self.actions,
+                    'users': len(self._users),
+                    'leaderboards': {pet_tag: list(top) for pet_tag, top in self._top.items()},
+                }
+                self._snapshot_at = now
+        return snapshot
+
+    def stats(self):
+        with self._lock:
+            return {'points': self.points, 'tasks': self.tasks, 'users': len(self._users)}
+
+
+def community_collector(community):
+    def collect():
+        stats = community.stats()
+        return [
+            ("ecobuddies_community_points", "gauge", {}, stats['points']),
+            ("ecobuddies_community_tasks", "gauge", {}, stats['tasks']),
+            ("ecobuddies_community_users", "gauge", {}, stats['users']),
+        ]
+    return collect
+
+
+community = Community.from_env()
+metrics.register_collector('community', community_collector(community))
@@ -0,0 +1,262 @@
+# Pet data and prompt templates, shared by the app and the content pack builder
+import json
+import re
+
+pets = {
+    'polarBear': {
+        'name': 'Snowflake',
+        'animal': 'Polar Bear',
+        'image' : 'PolarBear.gif',
+        'habitat': 'the Arctic',
+        'bg_color': '#032b44',
+        'emoji': '🐻‍❄️',
+
+    },
+    'koala': {
+        'name': 'Kiki',
+        'animal': 'Koala',
+        'image' : "Koala.gif",
+        'habitat': 'Eucalyptus forests of Eastern Australia',
+        'bg_color': "#7DAA92",
+        "emoji": '🐨',
+    },
+
+    'whale': {
+        'name': 'Nautica',
+        'animal': 'Humpback Whale',
+        'image' : "Whale.gif",
+        'habitat' :'ocean',
+        'bg_color': "#12204b",
+        'emoji': '🐋',
+    }
+}
+
+user_info = {
+    'age': 30,
+    'student': False,
+    'income_level': "Average",
+    'commitment_level': "Average"
+}
+
+INTRO_MESSAGE = """Briefly and concisely describe your NATURAL HABITAT, a THREAT, and a FUN FACT in a bullet list."""
+
+# Asked on the adventure page before the chat starts; the pet's first chat message answers it
+FIRST_CHAT_MESSAGE = """Suggest 3 mundane adventure-like activities the user can do in a sustainable way like going to the grocery store in a multi-step interactive way,
+asking pointed questions about the information provided. Let the user choose among the 3 activities and take into account how much time they can commit each day.
+Make sure to include something that could be related to the user's topics of interest based on the information above. 
+
+For example, ask the user how they would like to commute to the store then what they want to buy at the grocery store
+in a natural flowing way. Take into account the background of the user."""
+
+# Quiz answers are bucketed so similar users share cached and pre-generated content
+AGE_BANDS = [(12, 'under 13'), (17, '13-17'), (29, '18-29'), (59, '30-59'), (None, '60+')]
+STUDENT_OPTIONS = [False, True]
+INCOME_LEVELS = ["Low", "Below Average", "Average", "Above Average", "High"]
+COMMITMENT_LEVELS = ["A few minutes", "Occasionally", "Blend it in", "Throughout the day", "24/7"]
+TOPICS = ["Climate change", "Pollution", "Consumerism", "Agriculture", "Energy"]
+
+def age_band(age):
+    return next(label for limit, label in AGE_BANDS if limit is None or age <= limit)
+
+def make_profile(band, student, income_level, commitment_level):
+    # Key order matters: the profile is rendered into prompts with str()
+    return {
+        'age_band': band,
+        'student': student,
+        'income_level': income_level,
+        'commitment_level': commitment_level,
+    }
+
+def profile_bucket(info, topics=False):
+    profile = make_profile(
+        age_band(info.get('age', user_info['age'])),
+        bool(info.get('student', user_info['student'])),
+        info.get('income_level', user_info['income_level']),
+        info.get('commitment_level', user_info['commitment_level']),
+    )
+    if topics and 'topics_of_interest' in info:
+        profile['topics_of_interest'] = info['topics_of_interest']
+    return profile
+
+def pet_persona(pet_tag, profile=None):
+    # The pet's standing instructions; chat sessions send this once as the system instruction
+    pet = pets[pet_tag]
+    if profile is None:
+        profile = profile_bucket(user_info)
+    return f"""You are an AI agent for helping the user be sustainable, ONLY act for this purpose. 
+Your avatar is {pet['name']} a {pet['animal']} living in {pet['habitat']}.
+The user has the following characteristics: {str(profile)}. Give short but thoughtful answers which take the user's characteristics into account. 
+Speak in a friendly, helpful, positive tone.
+If the user asks how they can help, suggest eco-friendly tips.
+If you begin to get into an interactive mode with the user, make full use of the chat history and tell them what to do next or explain reasonings along the way. 
+"""
+
+def pet_prompt(user_message, pet_tag, conversation_context="", profile=None):
+    pet = pets[pet_tag]
+    return f"""{pet_persona(pet_tag, profile)}
+Previous conversation:
+{conversation_context}
+
+User's latest message: {user_message}
+        
+Respond as {pet['name']}, maintaining character and giving educational guidance on sustainability."""
+
+def pet_turn(user_message, pet_tag):
+    # The new user turn of a chat session; the persona already travels as the system instruction
+    pet = pets[pet_tag]
+    return f"""{user_message}
+
+(Respond as {pet['name']}, maintaining character and giving educational guidance on sustainability.)"""
+
+# Served when the model can't be reached and nothing was cached for the request
+def canned_reply(pet_tag):
+    pet = pets[pet_tag]
+    return (f"{pet['name']} the {pet['animal']} is out exploring {pet['habitat']} and can't talk right now. "
+            "Try again in a minute! Meanwhile, every eco action you take still counts.")
+
+def canned_task_details(task_name):
+    return [{
+        'way': f"{task_name} today",
+        'how': "Start small: pick one moment in your day where this fits and try it once.",
+        'why': "Small everyday habits add up, and every one of them helps our planet and its animals.",
+    }]
+
+# Page 4 asks for the ways, and how and why for each, in one schema-constrained reply
+TASK_DETAILS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'ways': {
+            'type': 'array',
+            'min_items': 1,
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'way': {'type': 'string'},
+                    'how': {'type': 'string'},
+                    'why': {'type': 'string'},
+                },
+                'required': ['way', 'how', 'why'],
+            },
+        },
+    },
+    'required': ['ways'],
+}
+
+def task_details_prompt(task_name):
+    return f"""
+        I want to {task_name.lower()}, please provide me three ways to do so.
+        For each way, give a short title, explain HOW to do it in a practical, simple, understandable way,
+        and WHY it matters for the environment or WHY it works. No quotation marks.
+        """
+
+def parse_task_details(text):
+    # Returns [{'way', 'how', 'why'}, ...]; raises ValueError if the reply doesn't match the schema
+    data = json.loads(text)
+    ways = data.get('ways') if isinstance(data, dict) else None
+    if not isinstance(ways, list) or not ways:
+        raise ValueError("Task details reply has no ways")
+    for way in ways:
+        if not isinstance(way, dict) or not all(isinstance(way.get(key), str) and way[key].strip() for key in ('way', 'how', 'why')):
+            raise ValueError(f"Malformed way in task details reply: {way!r}")
+    return [{key: way[key].strip() for key in ('way', 'how', 'why')} for way in ways[:3]]
+
+# Page 2: one photo at a time gets a free-text answer
+TRASH_PROMPT = """Analyze this image and identify the type of trash.
+                Then, in the same response, provide a brief suggestion on how to properly dispose of or reuse this type of trash.
+                Be specific in your identification and suggestion. Use a bullet list string with no quotation marks. """
+
+# Several photos go in one request, answered per photo in the order they were sent
+TRASH_BATCH_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'photos': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'items': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'item': {'type': 'string'},
+                                'disposal': {'type': 'string'},
+                            },
+                            'required': ['item', 'disposal'],
+                        },
+                    },
+                },
+                'required': ['items'],
+            },
+        },
+    },
+    'required': ['photos'],
+}
+
+def trash_batch_schema(count):
+    # One answer per photo sent
+    photos = dict(TRASH_BATCH_SCHEMA['properties']['photos'], min_items=count, max_items=count)
+    return dict(TRASH_BATCH_SCHEMA, properties={'photos': photos})
+
+def trash_batch_prompt(count):
+    photos = "Here is a photo of trash. For the photo," if count == 1 else f"Here are {count} photos of trash. For each photo, in the order given,"
+    return f"""
+        {photos} list every piece of trash you can see.
+        For each piece, identify the type of trash specifically and give a brief suggestion on how to properly
+        dispose of or reuse it. No quotation marks.
+        """
+
+def parse_trash_batch(text, count):
+    # Returns one [{'item', 'disposal'}, ...] list per photo; raises ValueError if the reply doesn't match the schema
+    data = json.loads(text)
+    photos = data.get('photos') if isinstance(data, dict) else None
+    if not isinstance(photos, list) or len(photos) < count:
+        raise ValueError(f"Trash reply covers {len(photos) if isinstance(photos, list) else 0} of {count} photos")
+    results = []
+    for photo in photos[:count]:
+        items = photo.get('items') if isinstance(photo, dict) else None
+        if not isinstance(items, list):
+            raise ValueError(f"Malformed photo in trash reply: {photo!r}")
+        for item in items:
+            if not isinstance(item, dict) or not all(isinstance(item.get(key), str) and item[key].strip() for key in ('item', 'disposal')):
+                raise ValueError(f"Malformed item in trash reply: {item!r}")
+        results.append([{key: item[key].strip() for key in ('item', 'disposal')} for item in items])
+    return results
+
+def format_trash_items(items):
+    # Same bullet list shape as a single-photo answer, so either can be cached and shown alike
+    if not items:
+        return "- No trash spotted in this photo. Try a closer shot!"
+    return "\n".join(f"- {item['item']}: {item['disposal']}" for item in items)
+
+# The adventure offers numbered choices; a short answer naming one of them is predictable
+ORDINALS = ['first', 'second', 'third', 'fourth', 'fifth']
+
+def parse_choices(text, limit=3):
+    # "1. Grocery run", "**2)** Bike to school: ..." -> the choice texts, if numbered from 1
+    choices = []
+    for line in text.splitlines():
+        match = re.match(r"\s*(?:[-*]\s*)?(?:\*\*)?(?:Option\s*)?(\d)[.):](?:\*\*)?\s+(.+)", line, re.IGNORECASE)
+        if match and int(match.group(1)) == len(choices) + 1:
+            choices.append(match.group(2).replace("**", "").strip())
+    return choices[:limit] if len(choices) >= 2 else []
+
+def match_choice(message, choices):
+    # Index of the choice the message picks ("2", "option 2", "the second one", or the choice's
+    # title), or None if it says anything more than that
+    words = re.findall(r"[a-z0-9]+", message.lower())
+    if not words:
+        return None
+    if len(words) <= 4:
+        picked = {i for i in range(len(choices)) if str(i + 1) in words or ORDINALS[i] in words}
+        if len(picked) == 1:
+            return picked.pop()
+    for i, choice in enumerate(choices):
+        title = re.split(r"[:–—]| - ", choice)[0]
+        if words in (re.findall(r"[a-z0-9]+", choice.lower()), re.findall(r"[a-z0-9]+", title.lower())):
+            return i
+    return None
+
+def choice_message(index, choice):
+    # What a speculative reply answers; a matching real message is served that reply
+    return f"I choose option {index + 1}: {choice}"
@@ -0,0 +1,148 @@
+import argparse
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from cache import cache_key
+from catalog import action_catalog
+from llm import BACKGROUND, CoordinatedBackend, backend_from_env, resilient_from_env
+from content import (
+    pets, INTRO_MESSAGE, AGE_BANDS, STUDENT_OPTIONS, INCOME_LEVELS, COMMITMENT_LEVELS,
+    make_profile, pet_prompt, TASK_DETAILS_SCHEMA, task_details_prompt, parse_task_details,
+)
+
+# Bump when the file layout changes; packs in another format are ignored
+PACK_FORMAT = 2
+
+
+class ContentPack:
+    # Pre-generated replies keyed like the response cache (normalized prompt + model), loaded on first use
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._meta = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._entries is not None:
+                return
+            entries = {}
+            if self.path and os.path.exists(self.path):
+                with gzip.open(self.path, "rt") as f:
+                    pack = json.load(f)
+                if pack.get('format') == PACK_FORMAT:
+                    entries = pack['entries']
+                    self._meta = {key: pack[key] for key in ('version', 'model', 'created') if key in pack}
+            self._entries = entries
+
+    def get(self, prompt, model_name):
+        if self._entries is None:
+            self._load()
+        text = self._entries.get(cache_key(prompt, model_name))
+        # Plain increments; an occasional lost count under contention is fine for a hit-rate gauge
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries or {}), **self._meta}
+
+
+content_pack = ContentPack(os.environ.get("ECOBUDDIES_CONTENT_PACK", "content_pack.json.gz"))
+metrics.register_collector('content_pack', metrics.cache_collector('content_pack', content_pack))
+
+
+def profiles(age_bands, students, incomes, commitments):
+    for band, student, income, commitment in itertools.product(age_bands, students, incomes, commitments):
+        yield make_profile(band, student, income, commitment)
+
+
+def build_pack(backend, pet_tags, profile_list, workers, version=None):
+    entries = {}
+    index = []
+    lock = threading.Lock()
+
+    def generate(kind, pet_tag, profile, subject, message, schema=None):
+        prompt = pet_prompt(message, pet_tag, "", profile)
+        key = cache_key(prompt, backend.model_name)
+        if key in entries:
+            return entries[key]
+        text = backend.generate(prompt, priority=BACKGROUND, schema=schema)
+        if schema is not None:
+            # A malformed reply fails the build instead of landing in the pack
+            parse_task_details(text)
+        with lock:
+            entries[key] = text
+            index.append({'key': key, 'kind': kind, 'pet': pet_tag, 'profile': profile, 'subject': subject})
+        return text
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs = []
+        for pet_tag, profile in itertools.product(pet_tags, profile_list):
+            jobs.append(pool.submit(generate, 'intro', pet_tag, profile, '', INTRO_MESSAGE))
+            for action in action_catalog.for_pet(pet_tag):
+                jobs.append(pool.submit(
+                    generate, 'details', pet_tag, profile, action['name'],
+                    task_details_prompt(action['name']), TASK_DETAILS_SCHEMA,
+                ))
+        for job in jobs:
+            job.result()
+
+    return {
+        'format': PACK_FORMAT,
+        'version': version or time.strftime("%Y%m%d%H%M%S"),
+        'model': backend.model_name,
+        'created': time.time(),
+        'index': index,
+        'entries': entries,
+    }
+
+
+def write_pack(pack, path):
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt") as f:
+        json.dump(pack, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def main():
+    band_labels = [label for _, label in AGE_BANDS]
+    parser = argparse.ArgumentParser(description="Pre-generate pet intros and task details into a content pack.")
+    parser.add_argument('--output', default=content_pack.path)
+    parser.add_argument('--pets', nargs='+', default=list(pets), choices=list(pets))
+    parser.add_argument('--ages', nargs='+', default=band_labels, choices=band_labels)
+    parser.add_argument('--students', nargs='+', default=['no', 'yes'], choices=['no', 'yes'])
+    parser.add_argument('--incomes', nargs='+', default=INCOME_LEVELS, choices=INCOME_LEVELS)
+    parser.add_argument('--commitments', nargs='+', default=COMMITMENT_LEVELS, choices=COMMITMENT_LEVELS)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=5, help="model calls per second")
+    parser.add_argument('--version', help="content version label (default: timestamp)")
+    parser.add_argument('--dry-run', action='store_true', help="only print how many profiles would be generated")
+    args = parser.parse_args()
+
+    students = [STUDENT_OPTIONS[1] if s == 'yes' else STUDENT_OPTIONS[0] for s in args.students]
+    profile_list = list(profiles(args.ages, students, args.incomes, args.commitments))
+    print(f"{len(args.pets)} pets x {len(profile_list)} profiles")
+    if args.dry_run:
+        return
+
+    backend = CoordinatedBackend(resilient_from_env(backend_from_env()), rate=args.rate, burst=max(1, int(args.rate)))
+    started = time.perf_counter()
+    pack = build_pack(backend, args.pets, profile_list, args.workers, version=args.version)
+    write_pack(pack, args.output)
+    print(f"Wrote {len(pack['entries'])} entries ({backend.calls} model calls, "
+          f"{time.perf_counter() - started:.1f}s) to {args.output}, version {pack['version']}")
+
+
+if __name__ == '__main__':
+    main()
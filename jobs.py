@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class QueueFull(RuntimeError):
+    # Raised by submit when the queue is at capacity; the caller should ask the user to retry
+    pass
+
+
+class Job:
+    # Handle to queued work; kept in session state and polled by the page that submitted it
+    def __init__(self, key, future):
+        self.key = key
+        self.future = future
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        # Raises whatever the work raised
+        return self.future.result()
+
+    def cancel(self):
+        # Only work that hasn't started can be cancelled
+        return self.future.cancel()
+
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.submitted_at
+
+
+class JobQueue:
+    # A fixed pool of workers in front of a bounded queue, so a burst of requests waits its
+    # turn or is turned away instead of tying up one script thread each
+    def __init__(self, name, workers=4, max_queued=16):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queued = 0
+        self.running = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-job")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name):
+        prefix = f"ECOBUDDIES_{name.upper()}"
+        return cls(
+            name,
+            workers=int(os.environ.get(f"{prefix}_WORKERS", 4)),
+            max_queued=int(os.environ.get(f"{prefix}_QUEUE", 16)),
+        )
+
+    def submit(self, key, fn, *args):
+        with self._lock:
+            if self.queued >= self.max_queued:
+                metrics.inc("ecobuddies_jobs_total", queue=self.name, result="rejected")
+                raise QueueFull(f"{self.name} queue is full")
+            self.queued += 1
+        job = Job(key, None)
+        job.future = self._pool.submit(self._run, job, fn, args)
+        job.future.add_done_callback(self._cancelled)
+        return job
+
+    def _run(self, job, fn, args):
+        job.started_at = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        metrics.observe("ecobuddies_job_wait_seconds", job.started_at - job.submitted_at, queue=self.name)
+        result = "error"
+        try:
+            value = fn(*args)
+            result = "ok"
+            return value
+        finally:
+            job.finished_at = time.monotonic()
+            with self._lock:
+                self.running -= 1
+            metrics.observe("ecobuddies_job_service_seconds", job.finished_at - job.started_at, queue=self.name)
+            metrics.inc("ecobuddies_jobs_total", queue=self.name, result=result)
+
+    def _cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+            metrics.inc("ecobuddies_jobs_total", queue=self.name, result="cancelled")
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self.queued, 'running': self.running, 'workers': self.workers, 'max_queued': self.max_queued}
+
+
+def queue_collector(queue):
+    def collect():
+        stats = queue.stats()
+        return [
+            ("ecobuddies_job_queue_depth", "gauge", {'queue': queue.name}, stats['queued']),
+            ("ecobuddies_job_running", "gauge", {'queue': queue.name}, stats['running']),
+        ]
+    return collect
+
+
+metrics.describe("ecobuddies_job_wait_seconds", "Time jobs spent queued before a worker picked them up")
+metrics.describe("ecobuddies_job_service_seconds", "Time workers spent running jobs")
+metrics.describe("ecobuddies_job_queue_depth", "Jobs waiting for a worker")
+
+# Photo identification: the vision call runs here instead of on the script thread
+vision_jobs = JobQueue.from_env('vision')
+metrics.register_collector('vision_jobs', queue_collector(vision_jobs))
@@ -0,0 +1,711 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import metrics
+from cache import normalize_prompt
+
+MODEL_NAME = 'gemini-2.0-flash'
+
+# Lower runs first when calls queue up behind the rate limiter
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+def contents_key(contents, model_name, schema=None, system=None):
+    # Stable key for a prompt, a [prompt, {"mime_type", "data"}] multimodal request, or chat turns
+    # [{"role", "parts"}], plus the response schema and system instruction if any
+    digest = hashlib.sha256(model_name.encode())
+    if schema is not None:
+        digest.update(json.dumps(schema, sort_keys=True).encode())
+    if system is not None:
+        digest.update(b"system\0" + normalize_prompt(system).encode())
+    for part in iter_parts(contents):
+        if isinstance(part, dict):
+            digest.update(part['mime_type'].encode())
+            digest.update(hashlib.sha256(part['data']).digest())
+        else:
+            digest.update(normalize_prompt(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def iter_parts(contents):
+    # Flattens chat turns into their parts, tagging each turn with its role
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, dict) and 'role' in item:
+            yield f"[{item['role']}]"
+            yield from item['parts']
+        else:
+            yield item
+
+
+class ModelUnavailable(RuntimeError):
+    # The model could not answer: retries ran out, the deadline passed, the circuit is open or
+    # the provider rejected the request. The original error is its __cause__.
+    pass
+
+
+def is_transient(error):
+    # Worth retrying: timeouts, dropped connections, rate limiting and 5xx from the provider.
+    # google.api_core errors carry the HTTP status as .code, so the SDK needn't be imported here.
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, 'code', None) in (429, 500, 502, 503, 504)
+
+
+def contents_bytes(contents, system=None):
+    size = len(system.encode()) if system else 0
+    return size + sum(len(part['data']) if isinstance(part, dict) else len(part.encode()) for part in iter_parts(contents))
+
+
+def record_usage(backend_name, prompt_tokens, response_tokens):
+    metrics.inc("ecobuddies_llm_tokens_total", prompt_tokens, backend=backend_name, kind="prompt")
+    metrics.inc("ecobuddies_llm_tokens_total", response_tokens, backend=backend_name, kind="response")
+
+
+class Backend:
+    model_name = None
+
+    def __init__(self):
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def _count_call(self):
+        with self._calls_lock:
+            self.calls += 1
+
+    def generate(self, contents, stream=False, schema=None, system=None):
+        # Returns the reply text, or an iterator of text chunks when stream is True. With a
+        # schema (an OpenAPI-style dict) the reply is JSON text matching it; not streamable.
+        # system is a system instruction, for chat turns sent as [{"role", "parts"}] contents.
+        if stream and schema is not None:
+            raise ValueError("Structured replies can't be streamed")
+        self._count_call()
+        metrics.inc("ecobuddies_llm_calls_total", backend=self.model_name, stream=stream)
+        metrics.inc("ecobuddies_llm_prompt_bytes_total", contents_bytes(contents, system), backend=self.model_name)
+        if stream:
+            return self._traced_stream(contents, system)
+        with metrics.span("llm_call", backend=self.model_name, structured=schema is not None) as attrs:
+            text = self._generate(contents, stream=False, schema=schema, system=system)
+            attrs['prompt_bytes'] = contents_bytes(contents, system)
+            attrs['response_bytes'] = len(text.encode())
+        metrics.inc("ecobuddies_llm_response_bytes_total", attrs['response_bytes'], backend=self.model_name)
+        return text
+
+    def _traced_stream(self, contents, system):
+        size = 0
+        with metrics.span("llm_stream", backend=self.model_name) as attrs:
+            start = time.perf_counter()
+            for chunk in self._generate(contents, stream=True, schema=None, system=system):
+                if not size:
+                    attrs['first_chunk_seconds'] = time.perf_counter() - start
+                    metrics.observe("ecobuddies_llm_first_chunk_seconds", attrs['first_chunk_seconds'], backend=self.model_name)
+                size += len(chunk.encode())
+                yield chunk
+            attrs['prompt_bytes'] = contents_bytes(contents, system)
+            attrs['response_bytes'] = size
+        metrics.inc("ecobuddies_llm_response_bytes_total", size, backend=self.model_name)
+
+    def _generate(self, contents, stream, schema, system):
+        raise NotImplementedError
+
+    def warm(self):
+        # Start any slow client setup in the background ahead of the first call
+        pass
+
+
+class GeminiBackend(Backend):
+    def __init__(self, model_name, api_key):
+        super().__init__()
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._system_models = OrderedDict()  # system instruction -> GenerativeModel, most recent last
+
+    @property
+    def model(self):
+        # The SDK takes most of a second to import, so it is loaded on first use, not at startup
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    with metrics.span("lazy_init", module="google.generativeai"):
+                        import google.generativeai as genai
+
+                        genai.configure(api_key=self.api_key)
+                        self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def warm(self):
+        if self._model is None:
+            threading.Thread(target=lambda: self.model, name="model-warm", daemon=True).start()
+
+    def model_for(self, system):
+        # The system instruction is fixed per GenerativeModel; building one is local and cheap,
+        # and chat sessions keep theirs for many turns, so a small LRU is plenty
+        default = self.model  # imports and configures the SDK
+        if system is None:
+            return default
+        with self._model_lock:
+            model = self._system_models.get(system)
+            if model is not None:
+                self._system_models.move_to_end(system)
+                return model
+        import google.generativeai as genai
+
+        model = genai.GenerativeModel(self.model_name, system_instruction=system)
+        with self._model_lock:
+            self._system_models[system] = model
+            while len(self._system_models) > 256:
+                self._system_models.popitem(last=False)
+        return model
+
+    def _generate(self, contents, stream, schema, system):
+        model = self.model_for(system)
+        if stream:
+            return self._stream(model, contents)
+        config = None
+        if schema is not None:
+            config = {"response_mime_type": "application/json", "response_schema": schema}
+        response = model.generate_content(contents, generation_config=config)
+        self._record_usage(response)
+        return response.text
+
+    def _stream(self, model, contents):
+        response = model.generate_content(contents, stream=True)
+        for chunk in response:
+            yield chunk.text
+        self._record_usage(response)
+
+    def _record_usage(self, response):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            record_usage(self.model_name, usage.prompt_token_count, usage.candidates_token_count)
+
+
+class FakeBackend(Backend):
+    # Offline stand-in: deterministic replies after a configurable, jittered delay
+    model_name = 'fake'
+
+    def __init__(self, latency=0.5, jitter=0.2, first_chunk=0.2, seed=None, error_rate=0.0):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.first_chunk = first_chunk  # share of the latency spent before the first chunk
+        self.error_rate = error_rate  # share of calls that fail like a dropped connection
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def _delay(self):
+        with self._random_lock:
+            if self._random.random() < self.error_rate:
+                raise ConnectionError("Fake backend outage")
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def reply_for(self, contents, schema=None, system=None):
+        digest = contents_key(contents, self.model_name, system=system)[:8]
+        if schema is not None:
+            return json.dumps(fake_value(schema, digest))
+        # Shaped like the real answers so the pages parse it: a header line and a bullet list
+        return (
+            f"Here are some ideas ({digest}):\n"
+            f"- Try a small eco-friendly habit today ({digest[:2]})\n"
+            f"- Share what you learned with a friend ({digest[2:4]})\n"
+            f"- Reuse something before you recycle it ({digest[4:6]})"
+        )
+
+    def _generate(self, contents, stream, schema, system):
+        text = self.reply_for(contents, schema, system)
+        # Same ~4 characters per token estimate the chat context uses
+        record_usage(self.model_name, contents_bytes(contents, system) // 4, len(text) // 4)
+        delay = self._delay()
+        if stream:
+            return self._stream(text, delay)
+        time.sleep(delay)
+        return text
+
+    def _stream(self, text, delay):
+        lines = text.splitlines(keepends=True)
+        time.sleep(delay * self.first_chunk)
+        for line in lines:
+            yield line
+            time.sleep(delay * (1 - self.first_chunk) / len(lines))
+
+
+def fake_value(schema, digest, name="item"):
+    # Deterministic instance of a JSON schema: three items per array unless the schema says
+    # otherwise, strings tagged with the digest
+    kind = schema['type'].lower()
+    if kind == 'object':
+        return {key: fake_value(sub, digest, key) for key, sub in schema['properties'].items()}
+    if kind == 'array':
+        count = min(max(3, schema.get('min_items', 0)), schema.get('max_items', 3))
+        return [fake_value(schema['items'], digest[i * 2:] + digest[:i * 2], name) for i in range(count)]
+    if kind in ('integer', 'number'):
+        return int(digest[:2], 16)
+    if kind == 'boolean':
+        return int(digest[0], 16) % 2 == 0
+    return f"Sample {name} ({digest})"
+
+
+class CassetteBackend(Backend):
+    # Records replies from another backend to a JSONL file, or replays them without it
+    def __init__(self, path, mode="replay", inner=None):
+        super().__init__()
+        if mode == "record" and inner is None:
+            raise ValueError("Recording a cassette needs a backend to record from")
+        self.path = path
+        self.mode = mode
+        self.inner = inner
+        self.model_name = inner.model_name if inner is not None else None
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._entries[entry['key']] = entry
+                    self.model_name = self.model_name or entry['model']
+        self.model_name = self.model_name or "cassette"
+
+    def warm(self):
+        if self.inner is not None:
+            self.inner.warm()
+
+    def _generate(self, contents, stream, schema, system):
+        key = contents_key(contents, self.model_name, schema, system)
+        if self.mode == "replay":
+            entry = self._entries.get(key)
+            if entry is None:
+                raise LookupError(f"No recorded reply in {self.path} for request {key[:12]}")
+            if stream:
+                return iter(entry['chunks'])
+            return "".join(entry['chunks'])
+
+        if stream:
+            return self._record_stream(key, self.inner._generate(contents, stream=True, schema=None, system=system))
+        text = self.inner._generate(contents, stream=False, schema=schema, system=system)
+        self._record(key, [text])
+        return text
+
+    def _record_stream(self, key, chunks):
+        recorded = []
+        for chunk in chunks:
+            recorded.append(chunk)
+            yield chunk
+        self._record(key, recorded)
+
+    def _record(self, key, chunks):
+        entry = {'key': key, 'model': self.model_name, 'chunks': chunks}
+        with self._lock:
+            self._entries[key] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class CoordinatedBackend:
+    # Process-wide front door for model calls: identical concurrent requests share one
+    # in-flight call, and every call waits for a token-bucket slot in priority order
+    def __init__(self, inner, rate=None, burst=1):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._waiting = []  # heap of [priority, ticket]; a waiter's priority can be raised while it waits
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+        self._inflight = {}  # request key -> (Future of the leader's reply, the leader's queue entry)
+        self._inflight_lock = threading.Lock()
+        if isinstance(inner, ResilientBackend):
+            # Retries and hedges are calls too, so they take tokens from this limiter
+            inner.limiter = self
+
+    @property
+    def calls(self):
+        return self.inner.calls
+
+    def warm(self):
+        self.inner.warm()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def entry(self, priority):
+        return [priority, next(self._tickets)]
+
+    def acquire(self, priority=INTERACTIVE, deadline=None, entry=None):
+        # Waits for a token; False if the deadline (a time.monotonic() value) passes first
+        if not self.rate:
+            return True
+        start = time.perf_counter()
+        acquired = False
+        with self._cond:
+            if entry is None:
+                entry = self.entry(priority)
+            heapq.heappush(self._waiting, entry)
+            metrics.set_gauge("ecobuddies_llm_queue_depth", len(self._waiting))
+            try:
+                while True:
+                    self._refill()
+                    if self._waiting[0] is entry and self._tokens >= 1:
+                        self._tokens -= 1
+                        acquired = True
+                        break
+                    # Only the head of the queue knows how long until the next token
+                    timeout = (1 - self._tokens) / self.rate if self._waiting[0] is entry else None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                metrics.set_gauge("ecobuddies_llm_queue_depth", len(self._waiting))
+                self._cond.notify_all()
+        metrics.observe("ecobuddies_llm_queue_wait_seconds", time.perf_counter() - start, priority=priority)
+        if not acquired:
+            metrics.inc("ecobuddies_llm_gave_up_total", backend=self.model_name, error="RateLimited")
+        return acquired
+
+    def promote(self, entry, priority):
+        # Someone more urgent is waiting on this entry's call, so it waits at their priority
+        with self._cond:
+            if priority < entry[0]:
+                entry[0] = priority
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def _deadline(self):
+        # The resilience layer's deadline also covers the wait for the first token
+        seconds = getattr(self.inner, 'deadline', None)
+        return time.monotonic() + seconds if seconds else None
+
+    def _acquire_within_deadline(self, priority, entry=None):
+        # Returns the keyword arguments that hand the deadline on to the resilience layer
+        deadline = self._deadline()
+        if not self.acquire(priority, deadline, entry):
+            raise ModelUnavailable("No rate-limit slot before the deadline")
+        return {} if deadline is None else {'deadline': deadline}
+
+    def try_acquire(self):
+        # A token only if one is free right now and nobody is queued for it
+        if not self.rate:
+            return True
+        with self._cond:
+            self._refill()
+            if self._waiting or self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def generate(self, contents, stream=False, priority=INTERACTIVE, schema=None, system=None):
+        if stream:
+            # Streams are consumed chunk by chunk by one page, so they are rate limited but not shared
+            extra = self._acquire_within_deadline(priority)
+            return self.inner.generate(contents, stream=True, priority=priority, schema=schema, system=system, **extra)
+
+        key = contents_key(contents, self.model_name, schema, system)
+        with self._inflight_lock:
+            leader = key not in self._inflight
+            if leader:
+                self._inflight[key] = (Future(), self.entry(priority))
+            flight, entry = self._inflight[key]
+        if not leader:
+            metrics.inc("ecobuddies_llm_coalesced_total", backend=self.model_name)
+            # An interactive call joining a queued background one (a prefetch) must not wait behind it
+            self.promote(entry, priority)
+            return flight.result()
+
+        try:
+            extra = self._acquire_within_deadline(priority, entry)
+            text = self.inner.generate(contents, priority=priority, schema=schema, system=system, **extra)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(text)
+            return text
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+
+class CircuitBreaker:
+    # Opens after `failures` transient failures in a row and fails calls fast for `cooldown`
+    # seconds; then one trial call is let through, and its outcome closes or reopens it
+    def __init__(self, failures=5, cooldown=30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+        metrics.set_gauge("ecobuddies_llm_circuit_open", 0)
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if not self._trial and self._count < self.failures:
+                return
+            self._opened_at = time.monotonic()
+            self._trial = False
+        metrics.inc("ecobuddies_llm_circuit_opened_total")
+        metrics.set_gauge("ecobuddies_llm_circuit_open", 1)
+
+
+class ResilientBackend:
+    # Deadline, jittered exponential-backoff retries, optional hedging and a circuit breaker
+    # around every model call. Gives up with ModelUnavailable so pages can fall back.
+    def __init__(self, inner, deadline=20.0, retries=2, backoff=0.5, hedge_percentile=None,
+                 breaker=None, seed=None):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies = deque(maxlen=200)  # recent successful call durations, for the hedge delay
+        self._latencies_lock = threading.Lock()
+        self.limiter = None  # set by the CoordinatedBackend in front, which admits the first attempt
+        self._random = random.Random(seed)
+        # Attempts run here so the caller can stop waiting at the deadline; a call that
+        # hangs past it is abandoned and its result dropped
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm")
+
+    @property
+    def calls(self):
+        return self.inner.calls
+
+    def warm(self):
+        self.inner.warm()
+
+    def generate(self, contents, stream=False, priority=INTERACTIVE, schema=None, system=None, deadline=None):
+        # deadline is passed in when the wait for the first rate-limit token already counted against it
+        if not self.breaker.allow():
+            metrics.inc("ecobuddies_llm_rejected_total", backend=self.model_name)
+            raise ModelUnavailable("Model circuit is open")
+        if deadline is None:
+            deadline = time.monotonic() + self.deadline
+        if stream:
+            return self._stream(contents, system, deadline, priority)
+        for attempt in itertools.count():
+            if attempt:
+                self._admit(priority, deadline)
+            try:
+                text = self._attempt(contents, schema, system, deadline, priority)
+            except Exception as e:
+                time.sleep(self._failed(e, attempt, deadline))
+            else:
+                self.breaker.success()
+                return text
+
+    def _admit(self, priority, deadline=None):
+        # Rate-limit token for a call after the first, waiting no later than the deadline. A hedge
+        # (no deadline given) only goes out if a token is free right now.
+        if self.limiter is None:
+            return True
+        if deadline is None:
+            return self.limiter.try_acquire()
+        if not self.limiter.acquire(priority, deadline):
+            raise ModelUnavailable("No rate-limit slot for a retry before the deadline")
+        return True
+
+    def _hedge_delay(self):
+        # The chosen percentile of recent latencies; None until there are enough samples
+        if not self.hedge_percentile:
+            return None
+        with self._latencies_lock:
+            ordered = sorted(self._latencies)
+        if len(ordered) < 20:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    def _attempt(self, contents, schema, system, deadline, priority):
+        # One call, plus a duplicate if it is still running past the hedge delay; first success wins
+        start = time.monotonic()
+        if start >= deadline:
+            # Don't pay for a call whose answer would be dropped
+            raise TimeoutError(f"Model call passed its {self.deadline:g}s deadline")
+        pending = {self._pool.submit(self.inner.generate, contents, False, schema, system)}
+        hedge_after = self._hedge_delay()
+        if hedge_after is not None and start + hedge_after < deadline:
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done and self._admit(priority):
+                metrics.inc("ecobuddies_llm_hedges_total", backend=self.model_name)
+                pending.add(self._pool.submit(self.inner.generate, contents, False, schema, system))
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    with self._latencies_lock:
+                        self._latencies.append(time.monotonic() - start)
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        metrics.inc("ecobuddies_llm_timeouts_total", backend=self.model_name)
+        raise TimeoutError(f"Model call passed its {self.deadline:g}s deadline")
+
+    def _failed(self, error, attempt, deadline):
+        # Returns how long to back off before the next attempt, or raises when it's time to give up
+        if not is_transient(error):
+            # The provider answered; the request itself is bad, so don't retry or trip the breaker.
+            # Pages still get ModelUnavailable, so they fall back instead of showing the error.
+            self.breaker.success()
+            metrics.inc("ecobuddies_llm_gave_up_total", backend=self.model_name, error=type(error).__name__)
+            raise ModelUnavailable(f"{type(error).__name__}: {error}") from error
+        self.breaker.failure()
+        delay = self._random.uniform(0, self.backoff * 2 ** attempt)
+        if attempt >= self.retries or time.monotonic() + delay >= deadline or self.breaker.is_open():
+            metrics.inc("ecobuddies_llm_gave_up_total", backend=self.model_name, error=type(error).__name__)
+            raise ModelUnavailable(f"{type(error).__name__}: {error}") from error
+        metrics.inc("ecobuddies_llm_retries_total", backend=self.model_name, error=type(error).__name__)
+        return delay
+
+    def _stream(self, contents, system, deadline, priority):
+        # The deadline and retries cover the wait for the first chunk; once text is on
+        # screen a failure can't be retried without repeating it
+        for attempt in itertools.count():
+            if attempt:
+                self._admit(priority, deadline)
+            chunks = self.inner.generate(contents, stream=True, system=system)
+            try:
+                first = self._pool.submit(next, chunks, None).result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                metrics.inc("ecobuddies_llm_timeouts_total", backend=self.model_name)
+                time.sleep(self._failed(TimeoutError(f"No reply within the {self.deadline:g}s deadline"), attempt, deadline))
+            except Exception as e:
+                time.sleep(self._failed(e, attempt, deadline))
+            else:
+                break
+        self.breaker.success()
+        if first is None:
+            return
+        yield first
+        try:
+            yield from chunks
+        except Exception as e:
+            if is_transient(e):
+                self.breaker.failure()
+            raise ModelUnavailable(f"Reply cut off: {type(e).__name__}: {e}") from e
+
+
+class ChatSession:
+    # One user's conversation with a pet. The persona is the session's system instruction, so
+    # each call sends it once as a fixed prefix followed by the turns as structured contents,
+    # instead of re-rendering everything into one big prompt. The API keeps no state between
+    # calls, so the caller still passes the (windowed) history every turn.
+    def __init__(self, backend, system, opening=None):
+        self.backend = backend
+        self.system = system
+        self.opening = opening  # the user turn the pet's first message answered
+
+    def contents(self, history, message, summary=""):
+        # history is chat_history-style [{"role": "user" | "assistant", "content"}]; consecutive
+        # messages from one side are merged, since the API expects the roles to alternate
+        contents = []
+        if summary:
+            contents.append({'role': 'user', 'parts': [f"Summary of the earlier conversation: {summary}"]})
+        elif self.opening and history and history[0]['role'] != 'user':
+            # The conversation has to open with a user turn
+            contents.append({'role': 'user', 'parts': [self.opening]})
+        for role, text in [(msg['role'], msg['content']) for msg in history] + [('user', message)]:
+            role = 'user' if role == 'user' else 'model'
+            if contents and contents[-1]['role'] == role:
+                contents[-1]['parts'].append(text)
+            else:
+                contents.append({'role': role, 'parts': [text]})
+        return contents
+
+    def send(self, contents, stream=False, priority=INTERACTIVE):
+        return self.backend.generate(contents, stream=stream, priority=priority, system=self.system)
+
+
+def backend_from_env():
+    kind = os.environ.get("ECOBUDDIES_BACKEND", "gemini")
+    if kind == "fake":
+        seed = os.environ.get("ECOBUDDIES_FAKE_SEED")
+        backend = FakeBackend(
+            latency=float(os.environ.get("ECOBUDDIES_FAKE_LATENCY", 0.5)),
+            jitter=float(os.environ.get("ECOBUDDIES_FAKE_JITTER", 0.2)),
+            seed=int(seed) if seed else None,
+            error_rate=float(os.environ.get("ECOBUDDIES_FAKE_ERROR_RATE", 0)),
+        )
+    elif kind == "gemini":
+        backend = None
+    else:
+        raise ValueError(f"Unknown ECOBUDDIES_BACKEND {kind!r}, expected 'gemini' or 'fake'")
+
+    cassette = os.environ.get("ECOBUDDIES_CASSETTE")
+    mode = os.environ.get("ECOBUDDIES_CASSETTE_MODE", "replay")
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown ECOBUDDIES_CASSETTE_MODE {mode!r}, expected 'record' or 'replay'")
+    if cassette and mode == "replay":
+        # Replaying never needs the live backend, so no API key is required
+        return CassetteBackend(cassette, mode="replay")
+    if backend is None:
+        backend = GeminiBackend(MODEL_NAME, os.environ.get("GEMINI_API_KEY"))
+    if cassette:
+        return CassetteBackend(cassette, mode=mode, inner=backend)
+    return backend
+
+
+def resilient_from_env(inner):
+    hedge = os.environ.get("ECOBUDDIES_LLM_HEDGE_PERCENTILE")
+    return ResilientBackend(
+        inner,
+        deadline=float(os.environ.get("ECOBUDDIES_LLM_DEADLINE", 20)),
+        retries=int(os.environ.get("ECOBUDDIES_LLM_RETRIES", 2)),
+        backoff=float(os.environ.get("ECOBUDDIES_LLM_BACKOFF", 0.5)),
+        hedge_percentile=float(hedge) if hedge else None,
+        breaker=CircuitBreaker(
+            failures=int(os.environ.get("ECOBUDDIES_BREAKER_FAILURES", 5)),
+            cooldown=float(os.environ.get("ECOBUDDIES_BREAKER_COOLDOWN", 30)),
+        ),
+    )
+
+
+# Shared by every session in the process, like the response cache. Coalescing and rate
+# limiting sit outside the resilience layer, so a hedge or retry never coalesces with itself.
+backend = CoordinatedBackend(
+    resilient_from_env(backend_from_env()),
+    rate=float(os.environ.get("ECOBUDDIES_RATE_LIMIT", 10)),
+    burst=int(os.environ.get("ECOBUDDIES_RATE_BURST", 20)),
+)
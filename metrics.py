@@ -0,0 +1,230 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, shared by every histogram not given its own with set_buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+TRACE_FILE = os.environ.get("ECOBUDDIES_TRACE_FILE")
+METRICS_PORT = os.environ.get("ECOBUDDIES_METRICS_PORT")
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_gauges = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_help = {}
+_buckets = {}  # histogram name -> bucket bounds, for histograms that aren't latencies
+_collectors = {}  # name -> fn returning [(metric, kind, labels, value)]
+_reports = {}  # name -> fn returning JSON text, served at /<name>
+
+_trace_buffer = []
+_trace_lock = threading.Lock()
+_server = None
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[(name, _labels_key(labels))] = value
+
+
+def observe(name, value, **labels):
+    key = (name, _labels_key(labels))
+    bounds = _buckets.get(name, BUCKETS)
+    with _lock:
+        buckets = _histograms.get(key)
+        if buckets is None:
+            buckets = _histograms[key] = [0] * (len(bounds) + 2)
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[len(bounds)] += 1
+        buckets[-1] += value
+
+
+def set_buckets(name, bounds):
+    # Call before the first observe for the name
+    _buckets[name] = tuple(bounds)
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def register_collector(name, fn):
+    # Collectors are polled at export time, for stats that already live elsewhere (cache hit counts...)
+    with _lock:
+        _collectors[name] = fn
+
+
+def register_report(name, fn):
+    # Reports are detail that doesn't fit in labels (which sessions are biggest...), served as JSON
+    with _lock:
+        _reports[name] = fn
+
+
+def cache_collector(cache_name, cache):
+    def collect():
+        stats = cache.stats()
+        return [
+            ("ecobuddies_cache_hits_total", "counter", {'cache': cache_name}, stats['hits']),
+            ("ecobuddies_cache_misses_total", "counter", {'cache': cache_name}, stats['misses']),
+            ("ecobuddies_cache_entries", "gauge", {'cache': cache_name}, stats['entries']),
+        ]
+    return collect
+
+
+@contextmanager
+def span(name, **labels):
+    # Times the block into ecobuddies_span_seconds{span=name, ...}. The yielded dict carries
+    # extra attributes (sizes, token counts) that go to the trace file but not to labels.
+    attrs = {}
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        error = type(e).__name__
+        inc("ecobuddies_span_errors_total", span=name, error=error, **labels)
+        raise
+    finally:
+        # st.rerun() and st.stop() unwind through here as BaseException, which is not an error
+        elapsed = time.perf_counter() - start
+        observe("ecobuddies_span_seconds", elapsed, span=name, **labels)
+        if TRACE_FILE:
+            trace(name, start, elapsed, labels, attrs, error)
+
+
+def trace(name, start, elapsed, labels, attrs, error=None):
+    record = {
+        'ts': time.time() - (time.perf_counter() - start),
+        'span': name,
+        'duration': elapsed,
+        'thread': threading.current_thread().name,
+        **labels,
+        **attrs,
+    }
+    if error:
+        record['error'] = error
+    with _trace_lock:
+        _trace_buffer.append(json.dumps(record))
+        if len(_trace_buffer) >= 100:
+            _flush_traces()
+
+
+def _flush_traces():
+    if _trace_buffer:
+        with open(TRACE_FILE, "a") as f:
+            f.write("\n".join(_trace_buffer) + "\n")
+        _trace_buffer.clear()
+
+
+def flush_traces():
+    if TRACE_FILE:
+        with _trace_lock:
+            _flush_traces()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: list(buckets) for key, buckets in _histograms.items()}
+        collectors = list(_collectors.values())
+    for collect in collectors:
+        for name, kind, labels, value in collect():
+            target = counters if kind == "counter" else gauges
+            target[(name, _labels_key(labels))] = value
+    return counters, gauges, histograms
+
+
+def render_prometheus():
+    counters, gauges, histograms = snapshot()
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), buckets in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(_buckets.get(name, BUCKETS) + ("+Inf",), buckets):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {buckets[-1]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        report = _reports.get(self.path.lstrip("/"))
+        if report is not None:
+            body, content_type = report().encode(), "application/json"
+        elif self.path == "/metrics":
+            body, content_type = render_prometheus().encode(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port):
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+
+describe("ecobuddies_span_seconds", "Time spent in instrumented screens, pages and model calls")
+describe("ecobuddies_span_errors_total", "Exceptions raised inside instrumented spans")
+
+atexit.register(flush_traces)
+
+if METRICS_PORT:
+    start_http_server(int(METRICS_PORT))
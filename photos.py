@@ -0,0 +1,89 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+PHOTO_MAX_EDGE = int(os.environ.get("ECOBUDDIES_PHOTO_MAX_EDGE", 768))
+PHOTO_FORMAT = os.environ.get("ECOBUDDIES_PHOTO_FORMAT", "jpeg")  # jpeg or webp
+PHOTO_QUALITY = int(os.environ.get("ECOBUDDIES_PHOTO_QUALITY", 85))
+
+
+def prepare_photo(data, max_edge=PHOTO_MAX_EDGE, fmt=PHOTO_FORMAT, quality=PHOTO_QUALITY):
+    # Decode once, downscale and re-encode; returns the image for display plus the upload bytes.
+    # PIL is imported on the first photo rather than at startup.
+    from PIL import Image, ImageOps
+
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    img = img.convert("RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format=fmt.upper(), quality=quality)
+    return img, buf.getvalue(), f"image/{fmt}"
+
+
+def dhash(img, size=8):
+    # Difference hash: one bit per horizontally adjacent pixel pair of a tiny grayscale copy
+    from PIL import Image
+
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return bits
+
+
+class PhotoCache:
+    def __init__(self, max_entries=256, max_distance=6):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # hash -> response, oldest first
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get("ECOBUDDIES_PHOTO_CACHE_SIZE", 256)),
+            max_distance=int(os.environ.get("ECOBUDDIES_PHOTO_HASH_DISTANCE", 6)),
+        )
+
+    def get(self, photo_hash):
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for known in self._entries:
+                distance = (known ^ photo_hash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = known, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best]
+
+    def set(self, photo_hash, response):
+        with self._lock:
+            self._entries[photo_hash] = response
+            self._entries.move_to_end(photo_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+            }
+
+
+photo_cache = PhotoCache.from_env()
+metrics.register_collector('photo_cache', metrics.cache_collector('photo', photo_cache))
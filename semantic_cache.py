@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+import metrics
+
+# Words that don't change what a sustainability question is about. "why" is kept out of
+# this list on purpose: it is the question's intent, see question_intent().
+STOP_WORDS = frozenset(
+    "a an the i me my we our you your do does did can could should would will to of for in on at "
+    "and or is are be it its this that these those how what where when which who with about there "
+    "any some get go much many".split()
+)
+QUESTION_WORDS = ('how', 'what', 'why', 'where', 'when', 'which', 'who', 'can', 'could', 'should',
+                  'is', 'are', 'do', 'does', 'will', 'would')
+
+
+def words(text):
+    return re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))
+
+
+def stem(word):
+    # Just enough to fold plurals and -ing forms together
+    for suffix in ("ing", "ies", "es", "s", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def content_words(text):
+    return [w for w in words(text) if len(w) > 1 and w not in STOP_WORDS and w != 'why']
+
+
+def is_question(text):
+    # Only standalone questions are worth sharing. One with a single content word ("what is
+    # next?") only makes sense in its conversation, and would match any other like it.
+    tokens = words(text)
+    if len(tokens) < 3 or len(content_words(text)) < 2:
+        return False
+    return text.rstrip().endswith("?") or tokens[0] in QUESTION_WORDS
+
+
+def question_intent(text):
+    # "why recycle batteries" and "how to recycle batteries" share every content word but not the answer
+    return 'why' if 'why' in words(text) else 'how'
+
+
+def namespace(pet_tag, question, profile=None):
+    # Answers are tailored to the asker's profile bucket, so they're only shared within it
+    return (pet_tag, tuple(sorted(profile.items())) if profile else None, question_intent(question))
+
+
+def embed(text, dim):
+    # Hashing vectorizer: stemmed content words, word bigrams and character 4-grams, signed-hashed
+    # into dim buckets and L2-normalized, so cosine similarity is a dot product
+    terms = [stem(w) for w in content_words(text)]
+    features = [(term, 1.0) for term in terms]
+    features += [(f"{a} {b}", 0.5) for a, b in zip(terms, terms[1:])]
+    for term in terms:
+        padded = f"<{term}>"
+        features += [(padded[i:i + 4], 0.3) for i in range(len(padded) - 3)]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in features:
+        h = zlib.crc32(feature.encode())
+        vector[h % dim] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    # Earlier chat answers indexed by question embedding, one row per answer in a fixed-size
+    # matrix. Lookups are restricted to the same pet, profile bucket and intent, and the least recently used
+    # row is overwritten when the matrix is full.
+    def __init__(self, max_entries=1024, dim=1024, threshold=0.75, thresholds=None, top_k=5):
+        self.max_entries = max_entries
+        self.dim = dim
+        self.threshold = threshold
+        self.thresholds = thresholds or {}  # pet tag -> threshold
+        self.top_k = top_k
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._namespaces = [None] * max_entries  # namespace() per row, None when free
+        self._answers = [None] * max_entries
+        self._used = np.zeros(max_entries, dtype=np.int64)  # lookup clock per row, for LRU
+        self._clock = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        thresholds = {}
+        for item in os.environ.get("ECOBUDDIES_SEMANTIC_THRESHOLDS", "").split(","):
+            if item.strip():
+                pet_tag, value = item.split("=")
+                thresholds[pet_tag.strip()] = float(value)
+        return cls(
+            max_entries=int(os.environ.get("ECOBUDDIES_SEMANTIC_CACHE_SIZE", 1024)),
+            threshold=float(os.environ.get("ECOBUDDIES_SEMANTIC_THRESHOLD", 0.75)),
+            thresholds=thresholds,
+        )
+
+    def search(self, pet_tag, question, profile=None, k=None):
+        # Top-k (similarity, row) among this pet's answers for the profile to questions with the same intent
+        vector = embed(question, self.dim)
+        with self._lock:
+            return self._search(vector, namespace(pet_tag, question, profile), k or self.top_k)
+
+    def _search(self, vector, namespace, k):
+        if not self._size:
+            return []
+        scores = self._vectors[:self._size] @ vector
+        mask = np.fromiter((ns == namespace for ns in self._namespaces[:self._size]), dtype=bool, count=self._size)
+        scores[~mask] = -1.0
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), int(row)) for row in top if scores[row] > -1.0]
+
+    def get(self, pet_tag, question, profile=None):
+        threshold = self.thresholds.get(pet_tag, self.threshold)
+        vector = embed(question, self.dim)
+        with self._lock:
+            matches = self._search(vector, namespace(pet_tag, question, profile), self.top_k)
+            if matches and matches[0][0] >= threshold:
+                row = matches[0][1]
+                self._clock += 1
+                self._used[row] = self._clock
+                self.hits += 1
+                answer = self._answers[row]
+            else:
+                self.misses += 1
+                answer = None
+        metrics.inc("ecobuddies_semantic_lookups_total", pet=pet_tag, result="hit" if answer is not None else "miss")
+        return answer
+
+    def add(self, pet_tag, question, answer, profile=None):
+        vector = embed(question, self.dim)
+        with self._lock:
+            if self._size < self.max_entries:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._used))
+                self.evictions += 1
+                metrics.inc("ecobuddies_cache_evictions_total", cache="semantic")
+            self._clock += 1
+            self._vectors[row] = vector
+            self._namespaces[row] = namespace(pet_tag, question, profile)
+            self._answers[row] = answer
+            self._used[row] = self._clock
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': self._size,
+                'evictions': self.evictions,
+            }
+
+
+# One index for the process: every session's answers help every other session
+semantic_cache = SemanticCache.from_env()
+metrics.register_collector('semantic_cache', metrics.cache_collector('semantic', semantic_cache))
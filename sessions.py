@@ -0,0 +1,186 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from store import progress_store
+
+# Rebuilt on demand by the pages, so they can be dropped from a session at any time
+DERIVED_FIELDS = ['chat_session', 'followup_panels', 'prefetch', 'vision_request', 'prompt_tokens', 'speculation']
+
+
+def state_bytes(value, seen=None):
+    # Deep size of plain data (dicts, lists, strings...). Other objects count only their own
+    # size, so shared things they point to (the backend, caches) aren't charged to every session.
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(state_bytes(k, seen) + state_bytes(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(state_bytes(item, seen) for item in value)
+    return size
+
+
+def archive_chat(state, user_id):
+    # Moves chat turns already folded into the running summary out of memory and into the
+    # progress store; the chat page reads them back only if asked to show earlier messages
+    summary = state['chat_summary'] if 'chat_summary' in state else None
+    if not summary or not summary['upto'] or 'chat_history' not in state:
+        return 0
+    history = state['chat_history']
+    upto = summary['upto']
+    archive = progress_store.load(user_id).get('chat_archive', []) + history[:upto]
+    progress_store.record(user_id, 'chat_archive', archive)
+    state['chat_history'] = history[upto:]
+    state['chat_summary'] = dict(summary, upto=0)
+    state['chat_archived'] = len(archive)
+    progress_store.record(user_id, 'chat_history', state['chat_history'])
+    progress_store.record(user_id, 'chat_archived', len(archive))
+    return upto
+
+
+def drop_derived(state):
+    for field in DERIVED_FIELDS:
+        if field in state:
+            del state[field]
+
+
+class SessionTracker:
+    # Per-session memory accounting over session state. Each script run is measured when it
+    # ends and compacted right away if over budget; a background thread compacts sessions
+    # that have gone idle and forgets sessions that have closed.
+    def __init__(self, budget=256 * 1024, idle=300.0, interval=30.0):
+        self.budget = budget
+        self.idle = idle
+        self.interval = interval
+        self._sessions = {}  # session id -> entry dict
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-janitor", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            budget=int(os.environ.get("ECOBUDDIES_SESSION_BUDGET", 256 * 1024)),
+            idle=float(os.environ.get("ECOBUDDIES_SESSION_IDLE", 300)),
+            interval=float(os.environ.get("ECOBUDDIES_SESSION_SWEEP_INTERVAL", 30)),
+        )
+
+    @contextmanager
+    def run(self, session_id, user_id, state):
+        # Wraps a script run or fragment rerun; a fragment inside a full run is measured with it.
+        # state is the run's thread-safe session state rather than the st.session_state proxy,
+        # which only works on the script thread, so the janitor can reach it later.
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = {
+                    'user_id': user_id, 'lock': threading.RLock(), 'depth': 0, 'bytes': 0, 'fields': {},
+                }
+        with entry['lock']:
+            entry['state'] = state
+            entry['depth'] += 1
+            try:
+                yield
+            finally:
+                entry['depth'] -= 1
+                if not entry['depth']:
+                    entry['last_seen'] = time.monotonic()
+                    entry['compacted'] = False
+                    self._measure(entry)
+                    if entry['bytes'] > self.budget:
+                        self._compact(entry, 'budget')
+
+    def _measure(self, entry):
+        fields = {key: state_bytes(value) for key, value in entry['state'].filtered_state.items()}
+        entry['fields'] = fields
+        entry['bytes'] = sum(fields.values())
+
+    def _compact(self, entry, reason):
+        # An active session over budget keeps its derived fields unless archiving wasn't enough
+        with metrics.span("session_compact", reason=reason) as attrs:
+            before = entry['bytes']
+            attrs['archived_turns'] = archive_chat(entry['state'], entry['user_id'])
+            self._measure(entry)
+            if reason != 'budget' or entry['bytes'] > self.budget:
+                drop_derived(entry['state'])
+                self._measure(entry)
+            attrs['freed_bytes'] = before - entry['bytes']
+        entry['compacted'] = True
+        if entry['bytes'] > self.budget:
+            metrics.inc("ecobuddies_session_over_budget_total")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                pass  # tried again next sweep
+
+    def sweep(self):
+        from streamlit import runtime
+
+        active = runtime.get_instance().is_active_session if runtime.exists() else lambda session_id: True
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._sessions.items())
+        for session_id, entry in entries:
+            closed = not active(session_id)
+            idle = now - entry.get('last_seen', now) > self.idle
+            # Skip a session whose script is running right now; it's measured when the run ends
+            if (idle or closed) and not entry.get('compacted') and entry['lock'].acquire(blocking=False):
+                try:
+                    self._compact(entry, 'closed' if closed else 'idle')
+                finally:
+                    entry['lock'].release()
+            if closed:
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+
+    def report(self, top=10):
+        with self._lock:
+            entries = list(self._sessions.values())
+        now = time.monotonic()
+        biggest = sorted(entries, key=lambda entry: entry['bytes'], reverse=True)[:top]
+        return {
+            'sessions': len(entries),
+            'total_bytes': sum(entry['bytes'] for entry in entries),
+            'budget': self.budget,
+            'biggest': [{
+                # Only a prefix: the full id is all it takes to load and change the user's progress
+                'user': entry['user_id'][:4],
+                'bytes': entry['bytes'],
+                'idle_seconds': round(now - entry.get('last_seen', now), 1),
+                'compacted': entry.get('compacted', False),
+                'fields': dict(sorted(entry['fields'].items(), key=lambda item: item[1], reverse=True)[:5]),
+            } for entry in biggest],
+        }
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': sum(entry['bytes'] for entry in self._sessions.values())}
+
+
+def tracker_collector(tracker):
+    def collect():
+        stats = tracker.stats()
+        return [
+            ("ecobuddies_sessions", "gauge", {}, stats['sessions']),
+            ("ecobuddies_session_state_bytes", "gauge", {}, stats['bytes']),
+        ]
+    return collect
+
+
+metrics.describe("ecobuddies_session_state_bytes", "Approximate bytes held in session state across tracked sessions")
+
+session_tracker = SessionTracker.from_env()
+metrics.register_collector('sessions', tracker_collector(session_tracker))
+metrics.register_report('sessions', lambda: json.dumps(session_tracker.report(), indent=2))
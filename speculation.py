@@ -0,0 +1,122 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+
+
+class Speculation:
+    # Replies being generated for the choices a message just offered, one future per choice
+    def __init__(self, choices, futures):
+        self.choices = choices
+        self.futures = futures
+
+
+class Speculator:
+    # Generates likely next replies in the background while the user reads, within a bound on
+    # calls in flight across the process. The hit rate and the tokens spent on replies nobody
+    # was served are tracked so the bound can be tuned.
+    def __init__(self, workers=2, max_inflight=6, wait=2.0):
+        self.max_inflight = max_inflight
+        self.wait = wait
+        self.inflight = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.generated_tokens = 0
+        self.served_tokens = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.environ.get("ECOBUDDIES_SPECULATE_WORKERS", 2)),
+            max_inflight=int(os.environ.get("ECOBUDDIES_SPECULATE_MAX_INFLIGHT", 6)),
+            wait=float(os.environ.get("ECOBUDDIES_SPECULATE_WAIT", 2)),
+        )
+
+    def start(self, choices, generate):
+        # generate(i) returns (reply text, prompt tokens) for choice i. Returns None when the
+        # speculation would go over budget.
+        with self._lock:
+            if self.inflight + len(choices) > self.max_inflight:
+                self.skipped += 1
+                metrics.inc("ecobuddies_speculation_total", result="skipped")
+                return None
+            self.inflight += len(choices)
+        futures = [self._pool.submit(self._generate, generate, i) for i in range(len(choices))]
+        return Speculation(choices, futures)
+
+    def _generate(self, generate, i):
+        try:
+            text, prompt_tokens = generate(i)
+        finally:
+            with self._lock:
+                self.inflight -= 1
+        tokens = prompt_tokens + len(text) // 4
+        with self._lock:
+            self.generated_tokens += tokens
+        metrics.inc("ecobuddies_speculation_tokens_total", tokens, kind="generated")
+        return text, tokens
+
+    def resolve(self, speculation, index):
+        # The reply for the chosen choice, or None when nothing matched, its generation failed or
+        # it isn't ready in time; the caller then asks the model itself. Replies that haven't
+        # started are cancelled, including a chosen one still queued behind other sessions'
+        # speculation, and one being generated is waited for at most `wait` seconds.
+        for future in speculation.futures:
+            if future.cancel():
+                with self._lock:
+                    self.inflight -= 1
+        result = None
+        outcome = "miss"
+        chosen = speculation.futures[index] if index is not None else None
+        if chosen is not None and not chosen.cancelled():
+            try:
+                result = chosen.result(timeout=self.wait)
+                outcome = "hit"
+            except TimeoutError:
+                outcome = "late"
+            except Exception:
+                pass  # served live instead
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.served_tokens += result[1]
+        metrics.inc("ecobuddies_speculation_total", result=outcome)
+        if result is None:
+            return None
+        metrics.inc("ecobuddies_speculation_tokens_total", result[1], kind="served")
+        return result[0]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'hit_rate': self.hits / total if total else 0.0,
+                'wasted_tokens': self.generated_tokens - self.served_tokens,
+                'inflight': self.inflight,
+            }
+
+
+def speculator_collector(speculator):
+    def collect():
+        stats = speculator.stats()
+        return [
+            ("ecobuddies_speculation_hit_rate", "gauge", {}, stats['hit_rate']),
+            ("ecobuddies_speculation_wasted_tokens", "gauge", {}, stats['wasted_tokens']),
+            ("ecobuddies_speculation_inflight", "gauge", {}, stats['inflight']),
+        ]
+    return collect
+
+
+metrics.describe("ecobuddies_speculation_wasted_tokens", "Estimated tokens spent on speculative replies that were never served")
+
+speculator = Speculator.from_env()
+metrics.register_collector('speculation', speculator_collector(speculator))
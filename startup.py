@@ -0,0 +1,94 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def app_imports(path=os.path.join(APP_DIR, "streamlit_app.py")):
+    # What streamlit_app.py imports before the first screen renders, in order: its module-level
+    # imports, minus the standard library. Read from the source so new modules are never missed.
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            modules = [node.module]
+        else:
+            continue
+        for module in modules:
+            name = module.split(".")[0]
+            if name not in sys.stdlib_module_names and name not in names:
+                names.append(name)
+    return names
+
+
+APP_IMPORTS = app_imports()
+
+# Modules that should only load on first use
+LAZY_MODULES = ['google.generativeai', 'PIL.Image', 'numpy']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for name in {imports!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr):
+    # -X importtime prints "import time: self | cumulative | name", nested imports indented by two spaces
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|", 2)
+        if total.strip().isdigit() and not name[1:].startswith(" "):
+            cumulative[name.strip()] = int(total) / 1e6
+    return cumulative
+
+
+def measure(imports=APP_IMPORTS):
+    # A fresh interpreter per run, so nothing is already imported
+    code = PROBE.format(imports=imports, lazy=LAZY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR, capture_output=True, text=True, check=True,
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    top_level = parse_importtime(result.stderr)
+    return {
+        'python': sys.version.split()[0],
+        'total_seconds': probe['seconds'],
+        'imports': {name: top_level.get(name, 0.0) for name in imports},
+        'eagerly_loaded': probe['loaded'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how long the app's imports take on a cold interpreter.")
+    parser.add_argument('--runs', type=int, default=3, help="report the fastest of this many runs")
+    parser.add_argument('--output', help="also write the report as JSON")
+    args = parser.parse_args()
+
+    report = min((measure() for _ in range(args.runs)), key=lambda r: r['total_seconds'])
+    print(f"{'import':<16}{'ms':>10}")
+    for name, seconds in report['imports'].items():
+        print(f"{name:<16}{seconds * 1000:>10.1f}")
+    print(f"{'total':<16}{report['total_seconds'] * 1000:>10.1f}")
+    if report['eagerly_loaded']:
+        print(f"Loaded at startup but meant to be lazy: {', '.join(report['eagerly_loaded'])}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Session state that survives restarts and is shared by every app process using the store
+PERSISTED_FIELDS = ['total_points', 'pet_points', 'completed_tasks', 'pet_happiness', 'sustainable_actions', 'chat_history', 'chat_archived', 'user_info']
+
+
+class ProgressStore:
+    def load(self, user_id):
+        # Returns {field: value} for everything saved for the user
+        raise NotImplementedError
+
+    def save_many(self, updates):
+        # Writes {user_id: {field: json text}} in one batch
+        raise NotImplementedError
+
+    def load_field(self, field):
+        # Returns {user_id: value} for every user with the field saved
+        raise NotImplementedError
+
+
+class MemoryProgressStore(ProgressStore):
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        with self._lock:
+            return {field: json.loads(value) for field, value in self._rows.get(user_id, {}).items()}
+
+    def save_many(self, updates):
+        with self._lock:
+            for user_id, fields in updates.items():
+                self._rows.setdefault(user_id, {}).update(fields)
+
+    def load_field(self, field):
+        with self._lock:
+            return {user_id: json.loads(fields[field]) for user_id, fields in self._rows.items() if field in fields}
+
+
+class SQLiteProgressStore(ProgressStore):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS progress ("
+                "user_id TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (user_id, field))"
+            )
+
+    def _connect(self):
+        # One connection per thread; WAL lets readers in other processes proceed during a flush
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def load(self, user_id):
+        rows = self._connect().execute("SELECT field, value FROM progress WHERE user_id = ?", (user_id,))
+        return {field: json.loads(value) for field, value in rows}
+
+    def save_many(self, updates):
+        now = time.time()
+        rows = [(user_id, field, value, now) for user_id, fields in updates.items() for field, value in fields.items()]
+        with self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO progress (user_id, field, value, updated_at) VALUES (?, ?, ?, ?)", rows)
+
+    def load_field(self, field):
+        rows = self._connect().execute("SELECT user_id, value FROM progress WHERE field = ?", (field,))
+        return {user_id: json.loads(value) for user_id, value in rows}
+
+
+class WriteBehindStore:
+    # Buffers mutations in memory and flushes them to the store in batched transactions,
+    # so a click never waits on a disk write
+    def __init__(self, store, interval=2.0):
+        self.store = store
+        self.interval = interval
+        self._pending = {}  # user_id -> {field: json text}, latest value wins
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls):
+        kind = os.environ.get("ECOBUDDIES_PROGRESS_STORE", "sqlite")
+        if kind == "sqlite":
+            store = SQLiteProgressStore(os.environ.get("ECOBUDDIES_PROGRESS_DB", "progress.db"))
+        elif kind == "memory":
+            store = MemoryProgressStore()
+        else:
+            raise ValueError(f"Unknown ECOBUDDIES_PROGRESS_STORE {kind!r}, expected 'sqlite' or 'memory'")
+        return cls(store, interval=float(os.environ.get("ECOBUDDIES_PROGRESS_FLUSH_INTERVAL", 2.0)))
+
+    def load(self, user_id):
+        saved = self.store.load(user_id)
+        # Read your own writes that haven't been flushed yet
+        with self._lock:
+            pending = dict(self._pending.get(user_id, {}))
+        saved.update({field: json.loads(value) for field, value in pending.items()})
+        return saved
+
+    def load_field(self, field):
+        values = self.store.load_field(field)
+        with self._lock:
+            pending = {user_id: fields[field] for user_id, fields in self._pending.items() if field in fields}
+        values.update({user_id: json.loads(value) for user_id, value in pending.items()})
+        return values
+
+    def record(self, user_id, field, value):
+        # Serialize now so later in-place edits to session state lists can't leak into the snapshot.
+        # Sets (completed tasks) are saved as sorted lists.
+        text = json.dumps(value, default=sorted)
+        with self._lock:
+            self._pending.setdefault(user_id, {})[field] = text
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with metrics.span("progress_flush") as attrs:
+            attrs['users'] = len(pending)
+            try:
+                self.store.save_many(pending)
+            except Exception:
+                # Put the batch back unless newer values arrived meanwhile, and retry next round
+                with self._lock:
+                    for user_id, fields in pending.items():
+                        merged = dict(fields)
+                        merged.update(self._pending.get(user_id, {}))
+                        self._pending[user_id] = merged
+                raise
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                pass  # counted by the span; the batch stays pending
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+progress_store = WriteBehindStore.from_env()
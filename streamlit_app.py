@@ -1,19 +1,45 @@
 import streamlit as st
 import streamlit.components.v1 as components  
-from PIL import Image
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import io
 import os
-import google.generativeai as genai
-import base64
 import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file before the modules below read their settings
 load_dotenv()
 
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
+from cache import response_cache
+from assets import asset_url, asset_bytes, record_page_bytes, warm_assets
+from photos import prepare_photo, dhash, photo_cache
+from jobs import vision_jobs, QueueFull
+from sessions import session_tracker
+from llm import backend, ChatSession, contents_bytes, INTERACTIVE, BACKGROUND, ModelUnavailable
+from metrics import span, inc, observe, set_buckets, describe
+from store import progress_store, PERSISTED_FIELDS
+from content import (
+    pets, user_info, INTRO_MESSAGE, FIRST_CHAT_MESSAGE, profile_bucket, pet_prompt, pet_persona, pet_turn,
+    TASK_DETAILS_SCHEMA, task_details_prompt, parse_task_details, canned_reply, canned_task_details,
+    parse_choices, match_choice, choice_message, TRASH_PROMPT, trash_batch_schema, trash_batch_prompt, parse_trash_batch, format_trash_items,
+)
+from content_packs import content_pack
+from catalog import action_catalog, DEFAULT_LOCALE
+from community import community
+from speculation import speculator
+
+PREFETCH_WORKERS = int(os.environ.get("ECOBUDDIES_PREFETCH_WORKERS", 4))
+CONTEXT_TURNS = int(os.environ.get("ECOBUDDIES_CONTEXT_TURNS", 8))
+CONTEXT_TOKENS = int(os.environ.get("ECOBUDDIES_CONTEXT_TOKENS", 1500))
+VISION_POLL_INTERVAL = float(os.environ.get("ECOBUDDIES_VISION_POLL_INTERVAL", 0.5))
+VISION_BATCH_SIZE = int(os.environ.get("ECOBUDDIES_VISION_BATCH_SIZE", 10))
+ACTIONS_PAGE_SIZE = int(os.environ.get("ECOBUDDIES_ACTIONS_PAGE_SIZE", 10))
+SPECULATE_CHOICES = int(os.environ.get("ECOBUDDIES_SPECULATE_CHOICES", 3))
+
+set_buckets("ecobuddies_chat_prompt_tokens", (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000))
+describe("ecobuddies_chat_prompt_tokens", "Estimated prompt tokens per chat turn")
 
 # set defaults
 defaults = {
@@ -26,87 +52,27 @@ defaults = {
     'page_number': 0,
     'total_points': 0,
     'current_task': None,
-    'completed_tasks': []
 }
 
+# Restore saved progress once per session; the uid query param keeps the same user across reloads
+if 'user_id' not in st.session_state:
+    if 'uid' not in st.query_params:
+        st.query_params['uid'] = uuid.uuid4().hex
+    st.session_state.user_id = st.query_params['uid']
+    for key, value in progress_store.load(st.session_state.user_id).items():
+        if key in PERSISTED_FIELDS:
+            st.session_state[key] = value
+    # Task names; a set for constant-time lookups, saved as a sorted list
+    st.session_state.completed_tasks = set(st.session_state.get('completed_tasks', []))
+
 for key, value in defaults.items():
     if key not in st.session_state:
         st.session_state[key] = value
 
-# Pet data 
-pets = {
-    'polarBear': {
-        'name': 'Snowflake',
-        'animal': 'Polar Bear',
-        'image' : 'PolarBear.gif',
-        'habitat': 'the Arctic',
-        'bg_color': '#032b44',
-        'emoji': '🐻‍❄️',
-
-    },
-    'koala': {
-        'name': 'Kiki',
-        'animal': 'Koala',
-        'image' : "Koala.gif",
-        'habitat': 'Eucalyptus forests of Eastern Australia',
-        'bg_color': "#7DAA92",
-        "emoji": '🐨',
-    },
-
-    'whale': {
-        'name': 'Nautica',
-        'animal': 'Humpback Whale',
-        'image' : "Whale.gif",
-        'habitat' :'ocean',
-        'bg_color': "#12204b",
-        'emoji': '🐋',
-    }
-}
-
-# Actions
-actions = []
-
-animal_actions = {
-    'koala': [
-        {'name': 'Bring Your Own Bag', 'points': 5, 'emoji': '🛍️'},
-        {'name': 'Refill Your Water Bottle', 'points': 5, 'emoji': '🚰'},
-        {'name': 'Turn Off Lights', 'points': 5, 'emoji': '💡'},
-        {'name': 'Walk or Bike Instead of Driving', 'points': 10, 'emoji': '🚲'},
-        {'name': 'Eat a Plant-Based Meal', 'points': 10, 'emoji': '🥗'},
-        {'name': 'Pick Up 3 Pieces of Litter', 'points': 10, 'emoji': '🧹'},
-        {'name': 'Unplug Electronics', 'points': 5, 'emoji': '🔌'},
-        {'name': 'Take a 5-Minute Shower', 'points': 5, 'emoji': '🚿'},
-        {'name': 'Recycle Something Today', 'points': 5, 'emoji': '♻️'},
-        {'name': 'Educate a Friend', 'points': 5, 'emoji': '📚'},
-    ],
-    'whale': [
-        {'name': 'Reduce Plastic Use', 'points': 10, 'emoji': '🚯'},
-        {'name': 'Use a Reusable Straw', 'points': 5, 'emoji': '🥤'},
-        {'name': 'Support Ocean Conservation', 'points': 20, 'emoji': '🌊'},
-        {'name': 'Participate in a Beach Cleanup', 'points': 15, 'emoji': '🏖️'},
-        {'name': 'Educate Others About Marine Life', 'points': 10, 'emoji': '📚'},
-        {'name': 'Choose Sustainable Seafood', 'points': 15, 'emoji': '🐟'},
-        {'name': 'Reduce Water Usage', 'points': 10, 'emoji': '💧'},
-        {'name': 'Use Eco-Friendly Products', 'points': 10, 'emoji': '🧴'}
-    ],
-    'polarBear' : [
-    {'name': 'Switch to Renewable Energy', 'points': 20, 'emoji': '🌞'},
-    {'name': 'Drive Less, Bike More', 'points': 15, 'emoji': '🚲'},
-    {'name': 'Eat a Plant-Based Meal', 'points': 10, 'emoji': '🥗'},
-    {'name': 'Reduce Home Heating Usage', 'points': 10, 'emoji': '🔥'},
-    {'name': 'Vote for Climate Policies', 'points': 20, 'emoji': '🗳️'},
-    {'name': 'Avoid Single-Use Plastics', 'points': 10, 'emoji': '🚯'},
-    {'name': 'Unplug Devices', 'points': 5, 'emoji': '🔌'},
-    {'name': 'Spread Awareness', 'points': 10, 'emoji': '📢'}
-    ]
-}
-
-user_info = {
-    'age': 30,
-    'student': False,
-    'income_level': "Average",
-    'commitment_level': "Average"
-}
+def save_progress(*fields):
+    # Buffered; written to the progress store in batches by a background thread
+    for field in fields:
+        progress_store.record(st.session_state.user_id, field, st.session_state[field])
 
 def set_background_color(color):
     st.markdown(
@@ -125,53 +91,525 @@ def set_pet(pet_name):
     st.session_state.selected_pet = pet_name
     st.session_state.current_screen = 'pet'
     st.session_state.page_number = 0
-    st.session_state.chat_history = []
+    reset_chat()
     st.rerun()
     return
 
-def display_action(actions):
-    for action in actions:
-        task_name = action['name']
-
-        if task_name in st.session_state.completed_tasks:
+def reset_chat():
+    st.session_state.chat_history = []
+    st.session_state.chat_summary = {'text': '', 'upto': 0}
+    st.session_state.chat_archived = 0
+    st.session_state.prompt_tokens = []
+    st.session_state.pop('chat_session', None)
+    discard_speculation()
+    save_progress('chat_history')
+    save_progress('chat_archived')
+    progress_store.record(st.session_state.user_id, 'chat_archive', [])
+
+def tracked():
+    # Every full run and fragment rerun is measured against the session's memory budget when it ends
+    ctx = get_script_run_ctx()
+    return session_tracker.run(ctx.session_id, st.session_state.user_id, ctx.session_state)
+
+def current_locale():
+    lang = st.query_params.get('lang', DEFAULT_LOCALE)
+    return lang if lang in action_catalog.locales else DEFAULT_LOCALE
+
+def set_action_page(page):
+    st.session_state.action_page = page
+
+def display_action(pet_tag):
+    # One filtered page of the pet's actions from the catalog's precomputed lists, so the
+    # number of buttons rendered doesn't grow with the catalog. Returns the actions shown.
+    categories = action_catalog.pet_categories(pet_tag)
+    locale = current_locale()
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        category = st.selectbox(
+            "Category", [None] + categories, key='action_category', on_change=set_action_page, args=(0,),
+            format_func=lambda c: "All" if c is None else action_catalog.category_label(c, locale),
+        )
+    with col2:
+        by_points = st.toggle("Most points first", key='action_by_points', on_change=set_action_page, args=(0,))
+    # Actions in the categories of the user's quiz topic come first
+    topic = st.session_state.get('user_info', user_info).get('topics_of_interest')
+    actions = action_catalog.for_pet(pet_tag, category=category, topic=topic, by_points=by_points)
+
+    pages = max(1, -(-len(actions) // ACTIONS_PAGE_SIZE))
+    page = min(st.session_state.get('action_page', 0), pages - 1)
+    visible = actions[page * ACTIONS_PAGE_SIZE:(page + 1) * ACTIONS_PAGE_SIZE]
+    for action in visible:
+        task_name = action_catalog.label(action, locale)
+
+        if action['name'] in st.session_state.completed_tasks:
             st.success(f"✅ {action['emoji']} {task_name} (Completed)")
         else:
-            if st.button(f"{action['emoji']} {task_name} (+{action['points']} pts)"):
+            if st.button(f"{action['emoji']} {task_name} (+{action['points']} pts)", key=f"action_{action['id']}"):
                 st.session_state.current_task = action
+                st.session_state.followup_panels = {}
                 st.session_state.page_number = 4  # Go to task detail page
                 st.rerun()
-                return
+                return visible
+
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        col1.button("⬅️ Previous page", disabled=page == 0, on_click=set_action_page, args=(page - 1,))
+        col2.caption(f"Page {page + 1} of {pages}")
+        col3.button("Next page ➡️", disabled=page == pages - 1, on_click=set_action_page, args=(page + 1,), key='action_next')
+    return visible
+
+# Fragments: a click inside one reruns only that function, not the whole script. Navigation
+# still goes through st.rerun(), which reruns the app.
+@st.fragment
+def show_progress_bar(eco_points, max_points=550):
+    with tracked(), span('fragment', fragment='progress_bar'):
+        progress = min(eco_points / max_points, 1.0)
+        progress_percentage = int(progress * 100)
+
+        bar_color = "#FFA500" if eco_points < max_points else "#00C851"
+
+        html_code = f""" 
+    <div style="background-color: lightgray; border-radius: 25px; padding: 5px; height: 40px;">
+       <div style="
+            background-color: {bar_color};
+            width: 0%;
+            height: 30px;
+            border-radius: 20px;
+            animation: fillAnimation 2s ease-in-out forwards;
+            position: relative;
+          ">
+         </div> 
+        <div style="
+            position: absolute;
+             top; 50%;
+            left: 50%;
+            transform: translate(-50%,-50%);
+            font-weight: bold;
+            color: black;
+            font-size: 16px;
+        ">
+        {eco_points} / {max_points} Happiness Points
+      </div>
+    </div>
+
+    <style>
+    @keyframes fillAnimation {{
+      from {{ width: 0%; }}
+      to {{ width: {progress_percentage}%; }}
+     }}
+    </style>
+     """
+        with span('progress_bar'):
+            components.html(html_code, height=70)
+
+def show_community(pet_tag):
+    # From the periodically rebuilt community snapshot, never from other users' progress
+    with span('community'):
+        snapshot = community.snapshot()
+        st.caption(f"🌍 Together, {snapshot['users']} EcoBuddies have earned {snapshot['points']} points "
+                   f"and completed {snapshot['tasks']} tasks!")
+        leaders = snapshot['leaderboards'].get(pet_tag)
+        if leaders:
+            with st.expander(f"🏆 Top {pets[pet_tag]['name']} helpers"):
+                st.markdown("\n".join(
+                    f"{rank}. {'You' if user_id == st.session_state.user_id else f'EcoBuddy #{user_id[:4]}'}: {points} pts"
+                    for rank, (points, user_id) in enumerate(leaders, 1)
+                ))
+
+@st.fragment
+def show_action_list(pet_tag):
+    with tracked(), span('fragment', fragment='actions'):
+        st.subheader("✅ Completed Tasks are marked green!")
 
-def get_pet_reply_with_gemini(user_message, pet_tag, chat_history=None):
+        visible = display_action(pet_tag)
+        prefetch_task_details(visible, pet_tag)
+
+@st.fragment
+def show_followups(idx, detail):
+    # One per way, so opening an answer doesn't rerun the page around it
+    with tracked(), span('fragment', fragment='followup'):
+        panels = st.session_state.setdefault('followup_panels', {})
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button(f"🔎 How?", key=f"how_{idx}"):
+                panels[detail['way']] = 'how'
+        with col2:
+            if st.button(f"💡 Why?", key=f"why_{idx}"):
+                panels[detail['way']] = 'why'
+
+        # If clicked, show the follow-up answer; it came with the ways, so no extra call
+        if panels.get(detail['way']) == 'how':
+            st.success(f"**How:** {detail['how']}")
+
+        if panels.get(detail['way']) == 'why':
+            st.info(f"**Why:** {detail['why']}")
+
+def queue_chat_message():
+    # Runs before the chat fragment: take the message and clear the box, so no second rerun is needed
+    st.session_state.pending_chat = st.session_state.chat_input
+    st.session_state.chat_input = ""
+
+@st.fragment
+def show_chat(pet_tag):
     pet = pets[pet_tag]
-    conversation_context = ""
-    if chat_history:
-        # Skip the most recent user message as we'll add it separately
-        for msg in chat_history[:-1]:  
-            role = "User" if msg["role"] == "user" else f"{pet_tag}"
-            conversation_context += f"{role}: {msg['content']}\n\n"
-        
-    prompt = f"""You are an AI agent for helping the user be sustainable, ONLY act for this purpose. 
-Your avatar is {pet['name']} a {pet['animal']} living in {pet['habitat']}.
-The user has the following characteristics: {str(user_info)}. Give short but thoughtful answers which take the user's characteristics into account. 
-Speak in a friendly, helpful, positive tone.
-If the user asks how they can help, suggest eco-friendly tips.
-If you begin to get into an interactive mode with the user, make full use of the chat history and tell them what to do next or explain reasonings along the way. 
+    with tracked(), span('fragment', fragment='chat'):
+        # Turns compacted out of memory are only read back if asked for
+        archived = st.session_state.get('chat_archived', 0)
+        if archived and st.toggle(f"Show {archived} earlier messages", key='show_archive'):
+            for msg in progress_store.load(st.session_state.user_id).get('chat_archive', []):
+                with st.chat_message(msg["role"], avatar=pet['emoji'] if msg["role"] == "assistant" else None):
+                    st.markdown(msg["content"])
 
-Previous conversation:
-{conversation_context}
+        # Display existing chat messages
+        for msg in st.session_state.chat_history:
+            with st.chat_message(msg["role"], avatar=pet['emoji'] if msg["role"] == "assistant" else None):
+                st.markdown(msg["content"])
 
-User's latest message: {user_message}
-        
-Respond as {pet['name']}, maintaining character and giving educational guidance on sustainability."""
-    response = model.generate_content(prompt)
-    return response.text
+        reply = None
+        # do first prompt to user
+        if len(st.session_state.chat_history) == 0:
+            with st.chat_message("assistant", avatar=pet['emoji']):
+                reply = st.write_stream(get_first_chat_with_gemini(pet_tag=pet_tag, stream=True))
+            st.session_state.chat_history.append({"role": "assistant", "content": reply})
+            save_progress('chat_history')
+
+        user_input = st.session_state.pop('pending_chat', '')
+        if user_input:
+            st.session_state.chat_history.append({"role": "user", "content": user_input})
+            with st.chat_message("user"):
+                st.markdown(user_input)
+
+            with st.chat_message("assistant", avatar=pet['emoji']):
+                reply = st.write_stream(chat_reply(user_input, pet_tag))
+
+            st.session_state.chat_history.append({"role": "assistant", "content": reply})
+            save_progress('chat_history')
+
+        st.text_input(f"Talk to {pet['name']}", key="chat_input", on_change=queue_chat_message)
+
+        # Started after the input box is on screen, since building the requests may summarize
+        if reply:
+            st.session_state.speculation = speculate_choices(reply, pet_tag)
+
+def chat_reply(user_input, pet_tag):
+    # Standalone questions are answered from earlier replies to near-identical ones, from any session
+    # with the same profile bucket. Imported here so numpy only loads once someone chats.
+    from semantic_cache import semantic_cache, is_question
+
+    # A pick among the choices just offered may already have its reply
+    speculation = st.session_state.pop('speculation', None)
+    if speculation is not None:
+        reply = speculator.resolve(speculation, match_choice(user_input, speculation.choices))
+        if reply is not None:
+            return iter([reply])
+
+    profile = current_profile(topics=True)
+    # Once the adventure has started, replies depend on the conversation; only a chat holding
+    # nothing but the opening message and this question is treated as standalone
+    history = st.session_state.chat_history
+    question = len(history) <= 2 and not st.session_state.get('chat_archived') and is_question(user_input)
+    if question:
+        answer = semantic_cache.get(pet_tag, user_input, profile)
+        if answer is not None:
+            return iter([answer])
+    return get_pet_reply_with_gemini(
+        user_message=user_input,
+        pet_tag=pet_tag,
+        chat_history=history,
+        stream=True,
+        profile=profile,
+        # Only a reply that streamed to the end is shared; a cut-off or canned one is not
+        on_complete=(lambda answer: semantic_cache.add(pet_tag, user_input, answer, profile)) if question else None,
+    )
+
+def speculate_choices(reply, pet_tag):
+    # While the user reads a reply offering numbered choices, each choice is answered in the background
+    choices = parse_choices(reply, SPECULATE_CHOICES) if SPECULATE_CHOICES else []
+    if not choices:
+        return None
+    requests = [
+        chat_request(choice_message(i, choice), pet_tag, st.session_state.chat_history, current_profile(topics=True))
+        for i, choice in enumerate(choices)
+    ]
+
+    def generate(i):
+        # Runs on a speculation worker; everything from session state was read above
+        session, contents = requests[i]
+        return session.send(contents, priority=BACKGROUND), contents_bytes(contents, session.system) // 4 + 1
+
+    return speculator.start(choices, generate)
+
+def discard_speculation():
+    speculation = st.session_state.pop('speculation', None)
+    if speculation is not None:
+        speculator.resolve(speculation, None)
+
+def current_profile(topics=False):
+    # Bucketed quiz answers, so similar users share cached and pre-generated replies
+    return profile_bucket(st.session_state.get('user_info', user_info), topics=topics)
+
+def record_prompt_tokens(tokens):
+    # Exported too, since session state is compacted away; the histogram shows whether chat prompts stay flat
+    st.session_state.setdefault('prompt_tokens', []).append(tokens)
+    observe("ecobuddies_chat_prompt_tokens", tokens)
+
+def get_pet_reply_with_gemini(user_message, pet_tag, chat_history=None, stream=False, priority=INTERACTIVE, profile=None, on_complete=None):
+    if profile is None:
+        profile = current_profile()
+    if chat_history:
+        # Skip the most recent user message as we'll add it separately
+        session, contents = chat_request(user_message, pet_tag, chat_history[:-1], profile)
+        record_prompt_tokens(contents_bytes(contents, session.system) // 4 + 1)
+        if stream:
+            return stream_chat_reply(session, contents, canned_reply(pet_tag), on_complete)
+        try:
+            return session.send(contents, priority=priority)
+        except ModelUnavailable:
+            inc("ecobuddies_llm_fallbacks_total", source="canned")
+            return canned_reply(pet_tag)
+
+    prompt = pet_prompt(user_message, pet_tag, "", profile)
+    if chat_history is not None:
+        record_prompt_tokens(estimate_tokens(prompt))
+    if stream:
+        return stream_gemini_reply(prompt, canned_reply(pet_tag))
+    return generate_text(prompt, priority, canned_reply(pet_tag))
+
+def chat_request(user_message, pet_tag, history, profile):
+    # The session and contents for the next chat turn after history
+    session = get_chat_session(pet_tag, profile)
+    summary, window = conversation_window(history, pet_tag)
+    return session, session.contents(window, pet_turn(user_message, pet_tag), summary)
+
+def get_chat_session(pet_tag, profile):
+    # One model conversation per user; started again when the persona changes (another pet, new quiz answers)
+    system = pet_persona(pet_tag, profile)
+    session = st.session_state.get('chat_session')
+    if session is None or session.system != system:
+        session = st.session_state.chat_session = ChatSession(backend, system, opening=FIRST_CHAT_MESSAGE)
+    return session
+
+def get_task_details(task_name, pet_tag, priority=INTERACTIVE, profile=None):
+    # Ways, how and why in one structured reply, cached as a unit
+    if profile is None:
+        profile = current_profile()
+    prompt = pet_prompt(task_details_prompt(task_name), pet_tag, "", profile)
+    cached = response_cache.get(prompt, backend.model_name)
+    if cached is None:
+        cached = content_pack.get(prompt, backend.model_name)
+    if cached is not None:
+        return parse_task_details(cached)
+    try:
+        text = backend.generate(prompt, priority=priority, schema=TASK_DETAILS_SCHEMA)
+        details = parse_task_details(text)
+    except (ModelUnavailable, ValueError):
+        # A malformed or truncated reply (JSONDecodeError is a ValueError) is handled like an outage
+        stale = fallback_reply(prompt, None)
+        return parse_task_details(stale) if stale is not None else canned_task_details(task_name)
+    # Only cached once it validates, so a malformed reply is asked for again next time
+    response_cache.set(prompt, backend.model_name, text)
+    return details
+
+def generate_text(prompt, priority=INTERACTIVE, fallback=None):
+    cached = response_cache.get(prompt, backend.model_name)
+    if cached is not None:
+        return cached
+    packed = content_pack.get(prompt, backend.model_name)
+    if packed is not None:
+        return packed
+    try:
+        text = backend.generate(prompt, priority=priority)
+    except ModelUnavailable:
+        if fallback is None:
+            raise
+        return fallback_reply(prompt, fallback)
+    response_cache.set(prompt, backend.model_name, text)
+    return text
+
+def fallback_reply(prompt, canned):
+    # Model is down: an expired cached answer for the same prompt beats the canned one. Neither is cached.
+    stale = response_cache.get_stale(prompt, backend.model_name)
+    inc("ecobuddies_llm_fallbacks_total", source="stale" if stale is not None else "canned")
+    return stale if stale is not None else canned
+
+# Rolling chat context: the newest turns verbatim, older ones folded into a running summary
+def estimate_tokens(text):
+    # ~4 characters per token; close enough to keep prompts flat without a count_tokens round-trip
+    return len(text) // 4 + 1
+
+def format_turn(msg, pet_tag):
+    role = "User" if msg["role"] == "user" else f"{pet_tag}"
+    return f"{role}: {msg['content']}\n\n"
+
+def window_start(turns, lowest, max_turns, max_tokens, pet_tag):
+    start = len(turns)
+    used = 0
+    while start > lowest and len(turns) - start < max_turns:
+        used += estimate_tokens(format_turn(turns[start - 1], pet_tag))
+        if used > max_tokens and start < len(turns):
+            break
+        start -= 1
+    return start
+
+def summarize_turns(summary, turns, pet_tag):
+    new_messages = "".join(format_turn(msg, pet_tag) for msg in turns)
+    prompt = f"""Update the running summary of a conversation between a user and {pet_tag}, an EcoBuddy helping them be sustainable.
+Keep the user's choices, facts about the user and where the adventure stands. Reply with the summary only, in at most 120 words.
+
+Current summary:
+{summary or "(none yet)"}
+
+New messages:
+{new_messages}"""
+    # If the model is down the summary just doesn't take in these turns
+    return generate_text(prompt, fallback=summary)
+
+def conversation_window(turns, pet_tag):
+    # Returns the running summary and the turns still sent verbatim
+    summary = st.session_state.setdefault('chat_summary', {'text': '', 'upto': 0})
+    if summary['upto'] > len(turns):
+        summary.update(text='', upto=0)
+
+    start = window_start(turns, summary['upto'], CONTEXT_TURNS, CONTEXT_TOKENS, pet_tag)
+    if start > summary['upto']:
+        # Over budget: fold down to half the window so the summary call only happens every few turns
+        start = window_start(turns, summary['upto'], CONTEXT_TURNS // 2, CONTEXT_TOKENS // 2, pet_tag)
+        summary['text'] = summarize_turns(summary['text'], turns[summary['upto']:start], pet_tag)
+        summary['upto'] = start
+
+    return summary['text'], turns[start:]
+
+def stream_gemini_reply(prompt, fallback):
+    cached = response_cache.get(prompt, backend.model_name)
+    if cached is None:
+        cached = content_pack.get(prompt, backend.model_name)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    try:
+        for chunk in backend.generate(prompt, stream=True):
+            chunks.append(chunk)
+            yield chunk
+    except ModelUnavailable:
+        # A reply cut off midway is left as it is rather than followed by a different one
+        if not chunks:
+            yield fallback_reply(prompt, fallback)
+        return
+    # Only cache once the stream completed
+    response_cache.set(prompt, backend.model_name, "".join(chunks))
+
+def stream_chat_reply(session, contents, fallback, on_complete=None):
+    # Conversation turns depend on the whole history, so they skip the response cache.
+    # on_complete gets the reply once it has streamed to the end.
+    chunks = []
+    try:
+        for chunk in session.send(contents, stream=True):
+            chunks.append(chunk)
+            yield chunk
+    except ModelUnavailable:
+        if not chunks:
+            inc("ecobuddies_llm_fallbacks_total", source="canned")
+            yield fallback
+        return
+    if on_complete is not None:
+        on_complete("".join(chunks))
+
+def submit_identification(photo_hashes, photos, itemized=False):
+    # Up to VISION_BATCH_SIZE photos go in one multimodal request, so sorting a bin takes about
+    # as long as one photo; a bigger pile is split into batches of that size. When sorting a bin,
+    # a lone photo also gets the itemized request, since it may hold several pieces of trash.
+    parts = [{"mime_type": mime_type, "data": photo_bytes} for _, photo_bytes, mime_type in photos]
+    jobs = []
+    try:
+        for start in range(0, len(parts), VISION_BATCH_SIZE):
+            hashes = photo_hashes[start:start + VISION_BATCH_SIZE]
+            batch = parts[start:start + VISION_BATCH_SIZE]
+            if len(batch) == 1 and not itemized:
+                jobs.append(vision_jobs.submit(hashes[0], identify_trash, hashes[0], [TRASH_PROMPT, batch[0]]))
+            else:
+                jobs.append(vision_jobs.submit(hashes, identify_trash_batch, hashes, batch))
+    except QueueFull:
+        # All or nothing: batches already queued would only hold places other users need
+        for job in jobs:
+            job.cancel()
+        raise
+    return jobs
+
+def identify_trash(photo_hash, contents):
+    # Runs on a vision worker, not the script thread
+    text = backend.generate(contents).strip()
+    photo_cache.set(photo_hash, text)
+    return {photo_hash: text}
+
+def identify_trash_batch(photo_hashes, parts):
+    contents = [trash_batch_prompt(len(parts))]
+    for number, part in enumerate(parts, 1):
+        contents += [f"Photo {number}:", part]
+    text = backend.generate(contents, schema=trash_batch_schema(len(parts)))
+    answers = {}
+    for photo_hash, items in zip(photo_hashes, parse_trash_batch(text, len(parts))):
+        answers[photo_hash] = format_trash_items(items)
+        photo_cache.set(photo_hash, answers[photo_hash])
+    return answers
+
+@st.fragment(run_every=VISION_POLL_INTERVAL)
+def show_vision_pending(jobs, count):
+    # Polls the jobs; once they're done the whole page reruns to show the answers and stop polling
+    with tracked(), span('fragment', fragment='vision'):
+        if all(job.done() for job in jobs):
+            st.rerun()
+        photos = "your photo" if count == 1 else f"your {count} photos"
+        st.info(f"🔍 Looking at {photos}... ({max(job.elapsed() for job in jobs):.0f}s)")
+
+# Prefetch task details in the background so page 4 renders from the response cache
+@st.cache_resource
+def get_prefetch_pool():
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+def prefetch_details(task_name, pet_tag, profile, cancel):
+    if cancel.is_set():
+        return None
+    return get_task_details(task_name, pet_tag, priority=BACKGROUND, profile=profile)
+
+def prefetch_task_details(actions, pet_tag):
+    if 'prefetch' not in st.session_state:
+        st.session_state.prefetch = {'cancel': threading.Event(), 'details': {}}
+    prefetch = st.session_state.prefetch
+    pool = get_prefetch_pool()
+    # Worker threads can't read session state, so they get the profile up front
+    profile = current_profile()
+    for action in actions:
+        task_name = action['name']
+        if task_name in st.session_state.completed_tasks or task_name in prefetch['details']:
+            continue
+        prefetch['details'][task_name] = pool.submit(prefetch_details, task_name, pet_tag, profile, prefetch['cancel'])
+
+def wait_for_prefetch(task_name):
+    prefetch = st.session_state.get('prefetch')
+    future = prefetch['details'].get(task_name) if prefetch else None
+    # A job still sitting in the queue is dropped and fetched live instead. One that is running
+    # isn't waited for: its model call may still be queued behind other calls at background
+    # priority, and the live call joins it at interactive priority instead.
+    if future is not None:
+        future.cancel()
+
+def cancel_prefetch():
+    prefetch = st.session_state.pop('prefetch', None)
+    if prefetch is None:
+        return
+    prefetch['cancel'].set()
+    for future in prefetch['details'].values():
+        future.cancel()
 
 # Perform an action
 def perform_action(points):
     st.session_state.pet_happiness = min(100, st.session_state.pet_happiness + points)
     st.session_state.sustainable_actions += 1
     st.session_state.total_points += points  # 🆕 add points to total_points
+    pet_total = add_pet_points(points)
+    community.record(st.session_state.user_id, st.session_state.selected_pet, points, actions=1, pet_total=pet_total)
+    save_progress('pet_happiness', 'sustainable_actions', 'total_points', 'pet_points')
 
     if st.session_state.sustainable_actions % 2 == 0:
         st.session_state.current_tip = st.session_state.sustainable_actions // 2 % len(pets[st.session_state.selected_pet]['tips'])
@@ -193,7 +631,7 @@ def style_image_buttons():
         </style>
     """, unsafe_allow_html=True)
 
-def clickable_image(image_path, key, pet_name):
+def clickable_image(image_src, key, pet_name):
     button_html = f"""
     <style>
         .img-button-{key} {{
@@ -213,16 +651,21 @@ def clickable_image(image_path, key, pet_name):
         }}
     </style>
     <button class="img-button-{key}" key="{key}" onClick="document.getElementById('{pet_name}').click();">
-        <img src="data:image/png;base64,{image_path}" alt="{pet_name}">
+        <img src="{image_src}" alt="{pet_name}">
     </button>
     """
     return button_html
 
-def image_to_base64(path):
-    with open(path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
+def show_pet_image(image, key, pet_name):
+    # Pet GIFs are pre-built 200px renditions served from ./static, not inlined per render
+    with span('pet_image'):
+        html = clickable_image(asset_url(image), key=key, pet_name=pet_name)
+        st.markdown(html, unsafe_allow_html=True)
+    return len(html.encode()), asset_bytes(image)
     
 def show_gif():
+    # The pet renditions are first shown on the welcome screen; build them while the user gets there
+    warm_assets()
     # Display the GIF only once
     st.image('https://media2.giphy.com/media/v1.Y2lkPTc5MGI3NjExNnYyemNzbzlobHJhcXBudHp5Z3o4cncyM2lycnh6ODYzcmk2bmpzdCZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9Zw/sx0NAad049ow46AsGU/giphy.gif', width=700)
     # Provide the user with a button to continue
@@ -249,6 +692,9 @@ def show_gif():
         st.rerun() 
 
 def show_quiz():
+    # Nothing before the pet pages needs the model, so its client loads while the user answers
+    backend.warm()
+
     st.title("Tell us about yourself!")
     st.subheader("This helps us customize your EcoBuddies experience (this will be shared with Google but is not tied to your name)")
     
@@ -281,6 +727,7 @@ def show_quiz():
             'commitment_level': commitment_level,
             'topics_of_interest': topics_of_interest
         }
+        save_progress('user_info')
         
         # Transition to the next screen
         st.session_state.current_screen = 'welcome'
@@ -307,6 +754,7 @@ def show_welcome():
     
     # Create columns dynamically based on number of pets
     cols = st.columns(len(pets))
+    page_bytes = [0, 0]
     
     # Display each pet in its column
     for i, pet in enumerate(pets):
@@ -315,53 +763,60 @@ def show_welcome():
                 st.session_state.selected_pet = pet['id']
                 st.session_state.current_screen = 'pet'
                 st.session_state.page_number = 0
-                st.session_state.chat_history = []
+                reset_chat()
                 st.rerun()
             
-            # Convert GIF to base64 and display
-            gif_base64 = image_to_base64(pet['image'])
-            st.markdown(clickable_image(gif_base64, key=pet['id'], pet_name=pet['name']), unsafe_allow_html=True)
+            html_bytes, image_bytes = show_pet_image(pet['image'], key=pet['id'], pet_name=pet['name'])
+            page_bytes[0] += html_bytes
+            page_bytes[1] += image_bytes
+
+    record_page_bytes('welcome', *page_bytes)
 
        
 def go_home():
     if st.button('🏠 Go Home'):
         st.session_state.page_number = 1
-        st.session_state.chat_history = []
+        reset_chat()
         st.rerun()
         return
 
+def add_pet_points(points):
+    pet_points = st.session_state.setdefault('pet_points', {})
+    pet_tag = st.session_state.selected_pet
+    pet_points[pet_tag] = pet_points.get(pet_tag, 0) + points
+    return pet_points[pet_tag]
+
 def complete_task(task):
     if task['name'] not in st.session_state.completed_tasks:
-        st.session_state.completed_tasks.append(task['name'])
+        pet_total = add_pet_points(task['points'])
+        # Recorded before the progress is saved, see Community.record
+        community.record(st.session_state.user_id, st.session_state.selected_pet, task['points'], tasks=1, pet_total=pet_total)
+        st.session_state.completed_tasks.add(task['name'])
         st.session_state.page_number = 1
         st.session_state.total_points += task['points']
+        save_progress('completed_tasks', 'total_points', 'pet_points')
         st.rerun()
         return
 
 def get_pet_intro_gemini(pet_tag):
-    msg = """Briefly and concisely describe your NATURAL HABITAT, a THREAT, and a FUN FACT in a bullet list."""
-    return get_pet_reply_with_gemini(msg, pet_tag)
-
-def get_first_chat_with_gemini(pet_tag):
-    msg = """Suggest 3 mundane adventure-like activities the user can do in a sustainable way like going to the grocery store in a multi-step interactive way,
-asking pointed questions about the information provided. Let the user choose among the 3 activities and take into account how much time they can commit each day.
-Make sure to include something that could be related to the user's topics of interest based on the information above. 
+    return get_pet_reply_with_gemini(INTRO_MESSAGE, pet_tag)
 
-For example, ask the user how they would like to commute to the store then what they want to buy at the grocery store
-in a natural flowing way. Take into account the background of the user."""
-    return get_pet_reply_with_gemini(msg, pet_tag)
+def get_first_chat_with_gemini(pet_tag, stream=False):
+    return get_pet_reply_with_gemini(FIRST_CHAT_MESSAGE, pet_tag, stream=stream, profile=current_profile(topics=True))
 
 def show_pet(): # main function
     pet_tag = st.session_state.selected_pet
     pet = pets[pet_tag]
     
     set_background_color(pet['bg_color'])
-    actions = animal_actions[pet_tag]
+
+    # Prefetched task details are only useful on the actions page and the task page it leads to
+    if st.session_state.page_number not in (1, 4):
+        cancel_prefetch()
 
     # --- Page 0: Meet your EcoBuddy ---
     if st.session_state.page_number == 0:
-        gif_base64 = image_to_base64(pet['image'])
-        st.markdown(clickable_image(gif_base64, key=pet_tag, pet_name=pet['name']), unsafe_allow_html=True)
+        record_page_bytes('pet/0', *show_pet_image(pet['image'], key=pet_tag, pet_name=pet['name']))
         
         st.title(f"Meet {pet['name']}!")
         resp = get_pet_intro_gemini(pet_tag)
@@ -374,59 +829,15 @@ def show_pet(): # main function
 
     # --- Page 1: Take Eco Actions ---
     elif st.session_state.page_number == 1:
-        # Convert GIF to base64 and display
-        gif_base64 = image_to_base64(pet['image'])
-        st.markdown(clickable_image(gif_base64, key=pet_tag, pet_name=pet['name']), unsafe_allow_html=True)
+        record_page_bytes('pet/1', *show_pet_image(pet['image'], key=pet_tag, pet_name=pet['name']))
 
         st.title(f"🌱 Take Action to Help {pet['name']}!")
 
         #Eco points 
-        import streamlit.components.v1 as components
-
-        eco_points = st.session_state.total_points 
-        max_points = 550
-
-        progress = min(eco_points / max_points, 1.0)
-        progress_percentage = int(progress * 100)
-
-        bar_color = "#FFA500" if eco_points < max_points else "#00C851"
-
-        html_code = f""" 
-    <div style="background-color: lightgray; border-radius: 25px; padding: 5px; height: 40px;">
-       <div style="
-            background-color: {bar_color};
-            width: 0%;
-            height: 30px;
-            border-radius: 20px;
-            animation: fillAnimation 2s ease-in-out forwards;
-            position: relative;
-          ">
-         </div> 
-        <div style="
-            position: absolute;
-             top; 50%;
-            left: 50%;
-            transform: translate(-50%,-50%);
-            font-weight: bold;
-            color: black;
-            font-size: 16px;
-        ">
-        {eco_points} / {max_points} Happiness Points
-      </div>
-    </div>
-
-    <style>
-    @keyframes fillAnimation {{
-      from {{ width: 0%; }}
-      to {{ width: {progress_percentage}%; }}
-     }}
-    </style>
-     """
-        components.html(html_code, height=70)
+        show_progress_bar(st.session_state.total_points)
+        show_community(pet_tag)
 
-        st.subheader("✅ Completed Tasks are marked green!")
-
-        display_action(actions)
+        show_action_list(pet_tag)
 
         st.markdown('---')
         st.subheader("What would you like to do next?")
@@ -447,34 +858,61 @@ def show_pet(): # main function
     elif st.session_state.page_number == 2:
         st.title('📸 Identify Trash')
 
-        img_data = st.camera_input("Take a picture of a piece of trash!")
+        if st.toggle("Sort a whole bin: several photos at once", key='trash_batch'):
+            uploads = st.file_uploader(
+                "Add a photo of each piece of trash", type=['jpg', 'jpeg', 'png', 'webp'], accept_multiple_files=True
+            )
+        else:
+            img_data = st.camera_input("Take a picture of a piece of trash!")
+            uploads = [img_data] if img_data else []
 
-        if img_data:
+        if uploads:
             try:
-                img = Image.open(img_data)
-                st.image(img, caption="Your photo", use_container_width=True)
-
-                # Convert image data to bytes for Gemini
-                img_bytes = img_data.getvalue()
-
-                # Prepare the prompt with image data AND instructions for disposal/reuse
-                prompt = """Analyze this image and identify the type of trash.
-                Then, in the same response, provide a brief suggestion on how to properly dispose of or reuse this type of trash.
-                Be specific in your identification and suggestion. Use a bullet list string with no quotation marks. """
-
-                contents = [
-                    prompt,
-                    {"mime_type": "image/png", "data": img_bytes}
-                ]
-
-                # Generate content using Gemini Pro Vision
-                response = model.generate_content(contents)
-                full_response = response.text.strip()
-
-                st.subheader("What to do:")
-                st.info(full_response)
-
-                st.info("Take another picture above to identify more trash!")
+                # Downscaled, re-encoded copies; the same decoded images are shown and hashed
+                with span('photo_prepare'):
+                    photos = [prepare_photo(upload.getvalue()) for upload in uploads]
+                if len(photos) == 1:
+                    st.image(photos[0][0], caption="Your photo", use_container_width=True)
+                else:
+                    st.image([img for img, _, _ in photos], caption=[f"Photo {n}" for n in range(1, len(photos) + 1)], width=120)
+
+                # Near-identical photos of the same item reuse the earlier identification
+                photo_hashes = [dhash(img) for img, _, _ in photos]
+                answers = {photo_hash: photo_cache.get(photo_hash) for photo_hash in photo_hashes}
+                missing = [i for i, photo_hash in enumerate(photo_hashes) if answers[photo_hash] is None]
+                key = tuple(photo_hashes[i] for i in missing)
+                request = st.session_state.get('vision_request')
+                # Finished jobs shrink missing; only a photo no job covers needs a new request
+                if missing and (request is None or not set(key) <= set(request['key'])):
+                    if request is not None:
+                        del st.session_state.vision_request
+                        for job in request['jobs']:
+                            job.cancel()
+                    # Generate content using Gemini Pro Vision, on vision workers
+                    jobs = submit_identification(key, [photos[i] for i in missing], itemized=st.session_state.trash_batch)
+                    request = st.session_state.vision_request = {'key': key, 'jobs': jobs}
+
+                if missing and not all(job.done() for job in request['jobs']):
+                    show_vision_pending(request['jobs'], len(photos))
+                else:
+                    if missing:
+                        # Dropped once read, so a failed identification is asked for again on the next run
+                        del st.session_state.vision_request
+                        for job in request['jobs']:
+                            answers.update(job.result())
+                    st.subheader("What to do:")
+                    for number, photo_hash in enumerate(photo_hashes, 1):
+                        if len(photos) > 1:
+                            st.markdown(f"**Photo {number}**")
+                        st.info(answers[photo_hash])
+
+                    st.info("Take another picture above to identify more trash!")
+
+            except QueueFull:
+                st.warning("Lots of trash is being identified right now. Please try again in a few seconds!")
+
+            except ModelUnavailable:
+                st.warning("Our trash expert is taking a break right now. Please try again in a minute!")
 
             except Exception as e:
                 st.error(f"An error occurred: {e}")
@@ -487,37 +925,9 @@ def show_pet(): # main function
         st.title(f"💬 Chat with {pet['name']} {pet['emoji']}")
 
         if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
-        
-        # do first prompt to user
-        if len(st.session_state.chat_history) == 0:
-            first_chat = get_first_chat_with_gemini(pet_tag=pet_tag)
-            st.session_state.chat_history.append({"role": "assistant", "content": first_chat})
+            reset_chat()
 
-        # Display existing chat messages
-        for msg in st.session_state.chat_history:
-            with st.chat_message(msg["role"], avatar=pet['emoji'] if msg["role"] == "assistant" else None):
-                st.markdown(msg["content"])
-
-        if "clear_chat_input" in st.session_state and st.session_state.clear_chat_input:
-            st.session_state.chat_input = ""
-            st.session_state.clear_chat_input = False
-
-        user_input = st.text_input(f"Talk to {pet['name']}", key="chat_input")
-
-        if user_input:
-            st.session_state.chat_history.append({"role": "user", "content": user_input})
-
-            gemini_reply = get_pet_reply_with_gemini(
-                user_message=user_input,
-                pet_tag=pet_tag,
-                chat_history=st.session_state.chat_history
-            )
-
-            st.session_state.chat_history.append({"role": "assistant", "content": gemini_reply})
-
-            st.session_state.clear_chat_input = True
-            st.rerun()
+        show_chat(pet_tag)
 
         go_home()
         
@@ -527,60 +937,22 @@ def show_pet(): # main function
         task_name = task['name']
         pet = pets[pet_tag]
 
-        gif_base64 = image_to_base64(pet['image'])
-        st.markdown(clickable_image(gif_base64, key=pet_tag, pet_name=pet['name']), unsafe_allow_html=True)
+        record_page_bytes('pet/4', *show_pet_image(pet['image'], key=pet_tag, pet_name=pet['name']))
 
-        st.title(f"{task['emoji']} Let's {task['name']}!")
+        st.title(f"{task['emoji']} Let's {action_catalog.label(task, current_locale())}!")
 
         st.write(f"🐾 {pet['name']} says:")
         st.success(f"Let's work together to {task['name'].lower()}! Here's how:")
         
         # DO TASK
-        # Ask Gemini for 3 ways (already done)
-        # --- inside your Page 4: Task Details ---
-
-# Ask Gemini for 3 ways (already done)
-        user_prompt = f"""
-        I want to do {task_name}, please provide me three ways to do so.
-        Give the output string in a bullet list, no quotation marks.
-        """
-        task_resp = get_pet_reply_with_gemini(user_prompt, pet_tag=pet_tag)
-
-        # Split the response into separate suggestions
-        ways = [way.strip("- ").strip("* ").strip() for way in task_resp.split("\n") if way.strip()]
-
-
-        # Initialize clicked keys if they don't exist
-        if "how_clicked" not in st.session_state:
-            st.session_state["how_clicked"] = None
-        if "why_clicked" not in st.session_state:
-            st.session_state["why_clicked"] = None
+        # Ask Gemini for 3 ways with their how and why, usually already warmed by the prefetch on page 1
+        wait_for_prefetch(task_name)
+        details = get_task_details(task_name, pet_tag)
 
         # Show each way with "How" and "Why" buttons
-        for idx, way in enumerate(ways):
-            st.markdown(f"**{way}**")
-            
-            if idx > 0:
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button(f"🔎 How?", key=f"how_{idx}"):
-                        st.session_state["how_clicked"] = idx
-                        st.session_state["why_clicked"] = None  # reset
-                with col2:
-                    if st.button(f"💡 Why?", key=f"why_{idx}"):
-                        st.session_state["why_clicked"] = idx
-                        st.session_state["how_clicked"] = None  # reset
-
-                # If clicked, show the follow-up answer
-                if st.session_state["how_clicked"] == idx:
-                    followup_prompt = f"Explain HOW to '{way}' in a practical, simple, understandable way."
-                    followup_response = get_pet_reply_with_gemini(followup_prompt, pet_tag=pet_tag)
-                    st.success(f"**How:** {followup_response}")
-
-                if st.session_state["why_clicked"] == idx:
-                    followup_prompt = f"Explain WHY it matters to '{way}' for the environment or WHY it works."
-                    followup_response = get_pet_reply_with_gemini(followup_prompt, pet_tag=pet_tag)
-                    st.info(f"**Why:** {followup_response}")
+        for idx, detail in enumerate(details):
+            st.markdown(f"**{detail['way']}**")
+            show_followups(idx, detail)
 
         # Normal Complete button for other tasks
         if st.button('✅ Complete Task'):
@@ -592,14 +964,17 @@ def main():
     # if 'current_screen' not in st.session_state:
     #     st.session_state.current_screen = 'gif'  # Start with the GIF screen
     curr_screen = st.session_state.current_screen
-    if curr_screen == 'gif':
-        show_gif()  # Show the GIF screen
-    elif curr_screen == 'quiz':
-        show_quiz()
-    elif curr_screen == 'welcome':
-        show_welcome()
-    elif curr_screen == 'pet':
-        show_pet()
+    # show_pet branches on page_number, so pet timings are labeled by page as well
+    page = st.session_state.page_number if curr_screen == 'pet' else ''
+    with tracked(), span('screen', screen=curr_screen, page=page):
+        if curr_screen == 'gif':
+            show_gif()  # Show the GIF screen
+        elif curr_screen == 'quiz':
+            show_quiz()
+        elif curr_screen == 'welcome':
+            show_welcome()
+        elif curr_screen == 'pet':
+            show_pet()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file